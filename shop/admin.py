@@ -1,16 +1,63 @@
 from django.contrib import admin
-from .models import Product, Comment, Category, Cart, CartItem, Order, OrderItem
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import (
+    Product,
+    Comment,
+    Category,
+    Cart,
+    CartItem,
+    Order,
+    OrderItem,
+    Job,
+    DailySales,
+    CategorySales,
+)
+from .search import filter_products
+
+
+class EstimatedCountPaginator(Paginator):
+    # Без фильтров на PostgreSQL берём оценку из статистики вместо COUNT(*) по всей таблице
+    ESTIMATE_FROM = 100_000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == "postgresql" and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [self.object_list.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.ESTIMATE_FROM:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class ProductAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "is_active")
-    search_fields = ("categories",)
+    search_fields = ("name",)
     filter_horizontal = ("categories",)
     list_filter = ("is_active",)
+    ordering = ("-pk",)
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_products(queryset, search_term), False
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = (
         "pk",
         "user",
@@ -20,30 +67,132 @@ class OrderAdmin(admin.ModelAdmin):
         "email",
         "address_street",
         "address_building",
+        "items_count",
         "total_price",
         "status",
     )
     list_filter = ("status",)
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    search_fields = ("email__iexact", "phone__startswith", "last_name__iexact")
+    readonly_fields = ("subtotal", "discount_amount", "total_price")
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(items_count=Count("items"))
 
-class CartItemAdmin(admin.ModelAdmin):
-    list_display = ("cart", "product", "quantity", "price")
+    @admin.display(description="Позиций", ordering="items_count")
+    def items_count(self, obj):
+        return obj.items_count
 
 
-class CartAdmin(admin.ModelAdmin):
-    list_display = ("pk", "user", "created_at", "session_key")
+class CartItemAdmin(LargeTableAdmin):
+    list_display = ("cart", "product", "quantity", "line_total")
+    list_select_related = ("cart__user", "product")
+    raw_id_fields = ("cart",)
+    autocomplete_fields = ("product",)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            line_total=F("quantity") * F("product__price")
+        )
 
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ("order", "product", "quantity", "price")
+    @admin.display(description="Сумма, BYN", ordering="line_total")
+    def line_total(self, obj):
+        return obj.line_total
+
+
+class CartAdmin(LargeTableAdmin):
+    list_display = ("pk", "user", "created_at", "session_key", "items_count", "items_total")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            items_count=Count("items"),
+            items_total=Sum(F("items__quantity") * F("items__product__price")),
+        )
+
+    @admin.display(description="Позиций", ordering="items_count")
+    def items_count(self, obj):
+        return obj.items_count
+
+    @admin.display(description="Сумма, BYN", ordering="items_total")
+    def items_total(self, obj):
+        return obj.items_total
+
+
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ("order", "product", "quantity", "unit_price", "price")
+    list_select_related = ("order__user", "product")
+    raw_id_fields = ("order",)
+    autocomplete_fields = ("product",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.order.refresh_subtotal()
+        obj.order.save()
+
+    def delete_model(self, request, obj):
+        order = obj.order
+        super().delete_model(request, obj)
+        order.refresh_subtotal()
+        order.save()
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list("order_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for order in Order.objects.filter(pk__in=order_ids):
+            order.refresh_subtotal()
+            order.save()
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ("pk", "user", "product", "rating", "created_at")
+    list_select_related = ("user", "product")
+    raw_id_fields = ("user",)
+    autocomplete_fields = ("product",)
 
-class CommentAdmin(admin.ModelAdmin):
-    list_display = ("pk", "user", "product", "created_at")
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ("name", "slug")
 
 
+class SalesAdmin(admin.ModelAdmin):
+    """Сводки только для чтения: их ведут сигналы и manage.py rebuild_sales."""
+
+    date_hierarchy = "date"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class DailySalesAdmin(SalesAdmin):
+    list_display = ("date", "order_count", "item_count", "revenue")
+
+
+class CategorySalesAdmin(SalesAdmin):
+    list_display = ("date", "category", "item_count", "revenue")
+    list_filter = ("category",)
+    list_select_related = ("category",)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("pk", "name", "status", "priority", "attempts", "run_at", "finished_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("locked_by", "locked_until", "last_error", "created_at", "finished_at")
+    actions = ["retry"]
+
+    @admin.action(description="Повторить выбранные задачи")
+    def retry(self, request, queryset):
+        queryset.exclude(status="running").update(
+            status="queued", attempts=0, run_at=timezone.now(), last_error=""
+        )
 
 
 admin.site.register(Product, ProductAdmin)
@@ -53,3 +202,6 @@ admin.site.register(Cart, CartAdmin)
 admin.site.register(CartItem, CartItemAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
+admin.site.register(CategorySales, CategorySalesAdmin)
@@ -0,0 +1,194 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CategorySales, DailySales, Order, OrderItem, OrderSalesCategory
+
+COUNTED_STATUS = "confirmed"
+
+
+def _day(order):
+    return timezone.localdate(order.created_at)
+
+
+def _row_increments(key, deltas, fields):
+    """Поля для update(): каждой строке (по значению key) — свой прирост, одним UPDATE.
+
+    deltas: {значение key: {поле: прирост}}. Прирост через F(), поэтому параллельные
+    заказы не теряют изменений друг друга.
+    """
+    return {
+        field: Case(
+            *[When(**{key: value}, then=F(field) + Value(row[field])) for value, row in deltas.items()],
+            default=F(field),
+            output_field=CategorySales._meta.get_field(field),
+        )
+        for field in fields
+    }
+
+
+def _category_lines(items):
+    """Вклад позиций в продажи категорий по их текущим категориям: строка на (заказ, категорию)."""
+    return (
+        items.filter(product__categories__isnull=False)
+        .annotate(day=TruncDate("order__created_at"))
+        .order_by()
+        .values("order_id", "day", "product__categories")
+        .annotate(
+            items=Sum("quantity"),
+            revenue=Sum(F("unit_price") * F("quantity"), output_field=DecimalField()),
+        )
+    )
+
+
+def _attributions(items):
+    return [
+        OrderSalesCategory(
+            order_id=line["order_id"],
+            category_id=line["product__categories"],
+            date=line["day"],
+            item_count=line["items"] or 0,
+            revenue=line["revenue"] or 0,
+        )
+        for line in _category_lines(items)
+    ]
+
+
+def attribute_order(order):
+    """Заново запоминает категории заказа, например после правки его позиций."""
+    OrderSalesCategory.objects.filter(order=order).delete()
+    return OrderSalesCategory.objects.bulk_create(_attributions(OrderItem.objects.filter(order=order)))
+
+
+def apply_order(order, sign):
+    """Добавляет (sign=1) или вычитает (sign=-1) подтверждённый заказ из сводок его дня.
+
+    При добавлении категории заказа запоминаются в OrderSalesCategory, при вычитании
+    берутся оттуда же: перенос товара в другую категорию не сдвигает сводки.
+    Число запросов не зависит от числа категорий в заказе: строки создаются одним
+    INSERT без конфликтов, приросты пишутся одним UPDATE на таблицу.
+    """
+    day = _day(order)
+    item_count = (
+        OrderItem.objects.filter(order=order).aggregate(total=Sum("quantity"))["total"] or 0
+    )
+
+    # Строка дня создаётся заранее, а меняется только UPDATE с F(): параллельные заказы не теряются
+    DailySales.objects.bulk_create([DailySales(date=day)], ignore_conflicts=True)
+    DailySales.objects.filter(date=day).update(
+        order_count=F("order_count") + sign,
+        item_count=F("item_count") + sign * item_count,
+        revenue=F("revenue") + sign * order.total_price,
+    )
+
+    if sign > 0:
+        attributions = OrderSalesCategory.objects.bulk_create(
+            _attributions(OrderItem.objects.filter(order=order)),
+            update_conflicts=True,
+            unique_fields=["order", "category"],
+            update_fields=["date", "item_count", "revenue"],
+        )
+    else:
+        attributions = list(OrderSalesCategory.objects.filter(order=order))
+        OrderSalesCategory.objects.filter(order=order).delete()
+    deltas = {
+        attribution.category_id: {
+            "item_count": sign * attribution.item_count,
+            "revenue": sign * attribution.revenue,
+        }
+        for attribution in attributions
+    }
+    if not deltas:
+        return
+    CategorySales.objects.bulk_create(
+        [CategorySales(date=day, category_id=category_id) for category_id in deltas],
+        ignore_conflicts=True,
+    )
+    CategorySales.objects.filter(date=day, category_id__in=deltas).update(
+        **_row_increments("category_id", deltas, ["item_count", "revenue"])
+    )
+
+
+def _bounds(since, until):
+    tz = timezone.get_current_timezone()
+    bounds = {}
+    if since:
+        bounds["created_at__gte"] = datetime.combine(since, time.min, tzinfo=tz)
+    if until:
+        bounds["created_at__lt"] = datetime.combine(until + timedelta(days=1), time.min, tzinfo=tz)
+    return bounds
+
+
+def rebuild_sales(since=None, until=None):
+    """Полный пересчёт сводок за период [since, until] (даты включительно) по заказам."""
+    bounds = _bounds(since, until)
+    orders = Order.objects.filter(status=COUNTED_STATUS, **bounds)
+    counted_items = OrderItem.objects.filter(
+        order__status=COUNTED_STATUS, **{f"order__{key}": value for key, value in bounds.items()}
+    )
+    items = counted_items.annotate(day=TruncDate("order__created_at"))
+
+    days = {
+        row["day"]: DailySales(
+            date=row["day"], order_count=row["orders"], revenue=row["revenue"] or 0
+        )
+        for row in orders.annotate(day=TruncDate("created_at"))
+        .order_by()
+        .values("day")
+        .annotate(orders=Count("id"), revenue=Sum("total_price"))
+    }
+    for row in items.order_by().values("day").annotate(total=Sum("quantity")):
+        days[row["day"]].item_count = row["total"] or 0
+
+    day_bounds = {}
+    if since:
+        day_bounds["date__gte"] = since
+    if until:
+        day_bounds["date__lte"] = until
+    in_range = Order.objects.filter(**bounds)
+    with transaction.atomic():
+        # Категории берутся из запомненных при подтверждении; заказам, подтверждённым
+        # в обход сигналов, они назначаются по текущим категориям товаров
+        OrderSalesCategory.objects.filter(order__in=in_range.exclude(status=COUNTED_STATUS)).delete()
+        OrderSalesCategory.objects.bulk_create(
+            _attributions(counted_items.filter(order__sales_categories__isnull=True)), batch_size=1000
+        )
+        category_rows = [
+            CategorySales(
+                date=row["date"],
+                category_id=row["category_id"],
+                item_count=row["items"] or 0,
+                revenue=row["revenue"] or 0,
+            )
+            for row in OrderSalesCategory.objects.filter(order__in=orders)
+            .order_by()
+            .values("date", "category_id")
+            .annotate(items=Sum("item_count"), revenue=Sum("revenue"))
+        ]
+        DailySales.objects.filter(**day_bounds).delete()
+        CategorySales.objects.filter(**day_bounds).delete()
+        DailySales.objects.bulk_create(days.values(), batch_size=1000)
+        CategorySales.objects.bulk_create(category_rows, batch_size=1000)
+    return len(days)
+
+
+def rebuild_day(day):
+    rebuild_sales(day, day)
+
+
+def sales_summary(since, until):
+    """Данные дашборда: только из сводных таблиц, без обращения к заказам."""
+    daily = list(DailySales.objects.filter(date__gte=since, date__lte=until).order_by("date"))
+    totals = DailySales.objects.filter(date__gte=since, date__lte=until).aggregate(
+        orders=Sum("order_count"), items=Sum("item_count"), revenue=Sum("revenue")
+    )
+    categories = (
+        CategorySales.objects.filter(date__gte=since, date__lte=until)
+        .values("category_id", "category__name")
+        .annotate(items=Sum("item_count"), revenue=Sum("revenue"))
+        .order_by("-revenue")
+    )
+    return {"daily": daily, "totals": totals, "categories": list(categories)}
@@ -0,0 +1,92 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .timing import note_cache
+
+TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", 300)
+# Сколько держится блокировка пересчёта и сколько остальные ждут его результата
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+PREFIX = "shop"
+
+
+def _key(*parts):
+    return ":".join((PREFIX, *map(str, parts)))
+
+
+def _count(name):
+    key = _key("stats", name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def stats():
+    hits = cache.get(_key("stats", "hit"), 0)
+    misses = cache.get(_key("stats", "miss"), 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None,
+    }
+
+
+def generation(name):
+    """Текущее поколение группы ключей; входит в ключи, поэтому bump() их инвалидирует."""
+    key = _key("gen", name)
+    value = cache.get(key)
+    if value is None:
+        # Начальное значение от часов, а не 1: после очистки кэша поколение не повторит
+        # прежнее, и старые ETag и ключи фрагментов не совпадут с новыми данными
+        cache.add(key, time.time_ns() // 1000, None)
+        value = cache.get(key)
+    return value
+
+
+def bump(*names):
+    for name in names:
+        key = _key("gen", name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns() // 1000, None)
+
+
+def make_key(name, *vary_on):
+    digest = hashlib.md5(":".join(map(str, vary_on)).encode()).hexdigest()
+    return _key("fragment", name, digest)
+
+
+def get_or_compute(key, compute, timeout=TIMEOUT):
+    """cache.get с защитой от лавины: при промахе пересчитывает только один запрос."""
+    value = cache.get(key)
+    if value is not None:
+        _count("hit")
+        note_cache(hit=True)
+        return value
+    _count("miss")
+    note_cache(hit=False)
+
+    lock = f"{key}:lock"
+    if cache.add(lock, 1, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock)
+        return value
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    # Пересчёт затянулся: лучше посчитать самим, чем отдать ошибку
+    return compute()
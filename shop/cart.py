@@ -0,0 +1,192 @@
+import json
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import prefetch_related_objects
+
+from . import services
+from .models import Cart, CartItem, Product
+
+COOKIE_NAME = "cart"
+COOKIE_SALT = "shop.cart"
+COOKIE_MAX_AGE = getattr(settings, "SESSION_CART_MAX_AGE", 60 * 60 * 24 * 30)
+# Подписанная cookie ограничена ~4 КБ
+MAX_LINES = 100
+
+
+class SessionCartItem:
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def price(self):
+        return self.product.price * self.quantity
+
+    @property
+    def price_per_one(self):
+        return self.product.price
+
+
+class SessionCart:
+    """Корзина анонимного покупателя в подписанной cookie: без записей в БД до входа."""
+
+    is_session = True
+
+    def __init__(self, request):
+        self.id = None
+        self.items = {}
+        self.modified = False
+        try:
+            data = json.loads(
+                request.get_signed_cookie(COOKIE_NAME, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+            )
+            self.id = str(data["id"])
+            self.items = {int(pk): int(quantity) for pk, quantity in data["items"].items()}
+        except (KeyError, ValueError, TypeError, AttributeError, signing.BadSignature):
+            pass
+
+    def _product_id(self, slug):
+        return Product.objects.filter(slug=slug).values_list("id", flat=True).first()
+
+    def _set(self, product_id, quantity):
+        if quantity > 0:
+            if product_id not in self.items and len(self.items) >= MAX_LINES:
+                return
+            self.items[product_id] = quantity
+        else:
+            self.items.pop(product_id, None)
+        self.modified = True
+
+    def add(self, product, amount=1):
+        self._set(product.pk, self.items.get(product.pk, 0) + amount)
+
+    def increase(self, slug, amount=1):
+        product_id = self._product_id(slug)
+        if product_id in self.items:
+            self._set(product_id, self.items[product_id] + amount)
+
+    def decrease(self, slug, amount=1):
+        product_id = self._product_id(slug)
+        quantity = self.items.get(product_id, 0) - amount
+        self._set(product_id, quantity)
+        return quantity > 0
+
+    def remove(self, slug):
+        self._set(self._product_id(slug), 0)
+
+    def lines(self):
+        products = Product.objects.in_bulk(list(self.items))
+        return [
+            SessionCartItem(products[pk], quantity)
+            for pk, quantity in sorted(self.items.items(), reverse=True)
+            if pk in products
+        ]
+
+    def line(self, slug):
+        for item in self.lines():
+            if item.product.slug == slug:
+                return item
+        return None
+
+    def total(self, lines=None):
+        lines = self.lines() if lines is None else lines
+        return sum((item.price for item in lines), Decimal("0"))
+
+    def save(self, response):
+        if not self.modified:
+            return
+        if not self.items:
+            response.delete_cookie(COOKIE_NAME)
+            return
+        self.id = self.id or uuid.uuid4().hex
+        response.set_signed_cookie(
+            COOKIE_NAME,
+            json.dumps({"id": self.id, "items": self.items}, separators=(",", ":")),
+            salt=COOKIE_SALT,
+            max_age=COOKIE_MAX_AGE,
+            httponly=True,
+            samesite="Lax",
+        )
+
+
+class UserCart:
+    is_session = False
+
+    def __init__(self, user):
+        self.cart, _ = Cart.objects.get_or_create(user=user)
+
+    def add(self, product, amount=1):
+        services.add_cart_item(self.cart, product, amount)
+
+    def increase(self, slug, amount=1):
+        services.increase_cart_item(self.cart, slug, amount)
+
+    def decrease(self, slug, amount=1):
+        return services.decrease_cart_item(self.cart, slug, amount)
+
+    def remove(self, slug):
+        services.remove_cart_item(self.cart, slug)
+
+    def lines(self):
+        prefetch_related_objects([self.cart], "items__product")
+        return list(self.cart.items.all())
+
+    def line(self, slug):
+        return (
+            CartItem.objects.filter(cart=self.cart, product__slug=slug)
+            .select_related("product")
+            .first()
+        )
+
+    def total(self, lines=None):
+        if lines is None:
+            return services.cart_total(self.cart)
+        return sum((item.price for item in lines), Decimal("0"))
+
+    def save(self, response):
+        pass
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return UserCart(request.user)
+    return SessionCart(request)
+
+
+def merge_session_cart(request, user):
+    """Переносит анонимную корзину в корзину пользователя одним upsert."""
+    session_cart = SessionCart(request)
+    if not session_cart.items:
+        return False
+    cart, _ = Cart.objects.get_or_create(user=user)
+    # session_key хранит id уже перенесённой cookie-корзины: повторный вход её не удвоит
+    if cart.session_key == session_cart.id:
+        return False
+
+    product_ids = set(
+        Product.objects.filter(pk__in=session_cart.items).values_list("id", flat=True)
+    )
+    existing = dict(
+        CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list(
+            "product_id", "quantity"
+        )
+    )
+    CartItem.objects.bulk_create(
+        [
+            CartItem(
+                cart=cart,
+                product_id=product_id,
+                quantity=existing.get(product_id, 0) + session_cart.items[product_id],
+            )
+            for product_id in product_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["cart", "product"],
+        update_fields=["quantity"],
+    )
+    cart.session_key = session_cart.id
+    cart.save(update_fields=["session_key"])
+    return True
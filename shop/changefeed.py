@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Order, OrderItem
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+BATCH_SIZE = 100
+MAX_BATCH_SIZE = 1000
+# Транзакция может зафиксироваться позже, чем выставлен её updated_at. Свежие строки
+# отдаются только через SETTLE_LAG секунд, чтобы курсор не перескочил через них
+SETTLE_LAG = getattr(settings, "ORDER_FEED_SETTLE_LAG", 5)
+
+
+def _after(cursor):
+    direction, values = decode_cursor(cursor)
+    if direction != "next" or len(values) != 2:
+        raise InvalidCursor(cursor)
+    updated_at, pk = parse_datetime(str(values[0])), values[1]
+    if updated_at is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk)
+
+
+def serialize_order(order):
+    return {
+        "id": order.pk,
+        "version": order.version,
+        "status": order.status,
+        "user_id": order.user_id,
+        "first_name": order.first_name,
+        "last_name": order.last_name,
+        "email": order.email,
+        "phone": order.phone,
+        "address_street": order.address_street,
+        "address_building": order.address_building,
+        "address_apartment": order.address_apartment,
+        "address_floor": order.address_floor,
+        "discount": order.discount,
+        "subtotal": str(order.subtotal),
+        "discount_amount": str(order.discount_amount),
+        "total_price": str(order.total_price),
+        "created_at": order.created_at.isoformat(),
+        "updated_at": order.updated_at.isoformat(),
+        "items": [
+            {
+                "product_id": item.product_id,
+                "product_name": item.product.name,
+                "quantity": item.quantity,
+                "unit_price": str(item.unit_price),
+            }
+            for item in order.items.all()
+        ],
+    }
+
+
+def order_changes(cursor=None, limit=BATCH_SIZE, settle_lag=SETTLE_LAG):
+    """Заказы, изменённые после cursor, по возрастанию (updated_at, id).
+
+    Возвращает пачку и курсор для следующего вызова; при пустой пачке курсор
+    не меняется. Удалённые заказы в ленту не попадают.
+    """
+    limit = max(1, min(limit, MAX_BATCH_SIZE))
+    orders = Order.objects.filter(updated_at__lte=timezone.now() - timedelta(seconds=settle_lag))
+    if cursor:
+        orders = orders.filter(_after(cursor))
+    items = OrderItem.objects.select_related("product").only(
+        "order_id", "product_id", "product__name", "quantity", "unit_price"
+    )
+    orders = list(
+        orders.order_by("updated_at", "id").prefetch_related(Prefetch("items", queryset=items))[:limit]
+    )
+    if orders:
+        cursor = encode_cursor([orders[-1].updated_at, orders[-1].pk])
+    return {
+        "orders": [serialize_order(order) for order in orders],
+        "cursor": cursor,
+        "has_more": len(orders) == limit,
+    }
@@ -0,0 +1,130 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Subquery, Sum, Value
+from django.views.decorators.http import condition
+
+from . import cache as page_cache
+from .models import Category, Order, Product
+
+
+def _personalization(request):
+    """Всё, что base.html и формы берут из запроса, а не из данных страницы."""
+    user = request.user
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    return (
+        user.pk,
+        user.get_username() if user.is_authenticated else "",
+        user.is_superuser,
+        hashlib.md5(csrf.encode()).hexdigest(),
+    )
+
+
+def _validators(request, state_func, args, kwargs):
+    # ETag и Last-Modified считаются по одному состоянию: запрос к БД выполняется один раз
+    if not hasattr(request, "_page_validators"):
+        request._page_validators = None
+        # Непоказанные сообщения выводятся в base.html — такой ответ 304 быть не может
+        if request.method in ("GET", "HEAD") and not len(get_messages(request)):
+            state = state_func(request, *args, **kwargs)
+            if state is not None:
+                last_modified, parts = state
+                raw = repr((parts, last_modified, _personalization(request)))
+                request._page_validators = (
+                    hashlib.md5(raw.encode()).hexdigest(),
+                    # Без ETag клиент сравнит только дату, а она не учитывает вход и выход
+                    last_modified if not request.user.is_authenticated else None,
+                )
+    return request._page_validators
+
+
+def conditional_page(state_func):
+    """@condition, где оба валидатора берутся из state_func(request, *args, **kwargs),
+    возвращающей (время последнего изменения, прочие части ETag) или None."""
+
+    def etag(request, *args, **kwargs):
+        validators = _validators(request, state_func, args, kwargs)
+        return validators and validators[0]
+
+    def last_modified(request, *args, **kwargs):
+        validators = _validators(request, state_func, args, kwargs)
+        return validators and validators[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _latest(*values):
+    return max((value for value in values if value is not None), default=None)
+
+
+def _catalog_aggregate():
+    categories = Category.objects.order_by().values(stub=Value(1)).values("stub")
+    # Категории — скалярными подзапросами внутри того же агрегата: один запрос к БД.
+    # Удаление товара или категории не двигает MAX(updated_at), поэтому есть и количества;
+    # оценки меняются без updated_at, но видны в карточках и сортировке
+    state = Product.objects.aggregate(
+        updated=Max("updated_at"),
+        count=Count("id"),
+        ratings=Sum("rating_sum"),
+        categories_updated=Max(Subquery(categories.annotate(value=Max("updated_at")).values("value"))),
+        categories_count=Max(Subquery(categories.annotate(value=Count("id")).values("value"))),
+    )
+    if not state["count"]:
+        # Без товаров агрегат по ним не видит подзапросов: категории считаем отдельно
+        categories = Category.objects.aggregate(updated=Max("updated_at"), count=Count("id"))
+        state.update(categories_updated=categories["updated"], categories_count=categories["count"])
+    return state
+
+
+def catalog_version(request):
+    """Состояние каталога для ETag и ключа кэша страниц; считается один раз на запрос.
+
+    Берётся из БД, а не только из поколения "catalog" в кэше: с локальным кэшем у каждого
+    процесса своё поколение, и процесс, не видевший записи, отдавал бы устаревшую страницу.
+    """
+    if not hasattr(request, "_catalog_version"):
+        state = _catalog_aggregate()
+        parts = (
+            state["count"],
+            state["ratings"],
+            state["categories_count"],
+            # Счётчики фильтров пересчитываются в обход updated_at и сдвигают только поколение
+            page_cache.generation("catalog"),
+        )
+        request._catalog_version = (
+            _latest(state["updated"], state["categories_updated"]),
+            parts,
+            hashlib.md5(repr((state["updated"], state["categories_updated"], parts)).encode()).hexdigest(),
+        )
+    return request._catalog_version
+
+
+def catalog_state(request, slug=None):
+    last_modified, parts, _ = catalog_version(request)
+    return last_modified, parts
+
+
+def product_state(request, slug):
+    row = (
+        Product.objects.filter(slug=slug)
+        .values_list("updated_at", "last_comment_at", "comment_count", "rating_sum")
+        .first()
+    )
+    if row is None:
+        return None
+    updated_at, last_comment_at, *counters = row
+    return _latest(updated_at, last_comment_at), tuple(counters)
+
+
+def order_state(request, pk):
+    row = (
+        Order.objects.filter(pk=pk)
+        .annotate(products_updated=Max("items__product__updated_at"), items_count=Count("items"))
+        .values_list("updated_at", "products_updated", "items_count")
+        .first()
+    )
+    if row is None:
+        return None
+    updated_at, products_updated, items_count = row
+    return _latest(updated_at, products_updated), (items_count,)
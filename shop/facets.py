@@ -0,0 +1,74 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import PRICE_BUCKETS, Category, PriceBucket, Product
+
+ProductCategory = Product.categories.through
+
+
+def change_category_counts(category_ids, delta):
+    if category_ids and delta:
+        Category.objects.filter(pk__in=category_ids).update(
+            product_count=F("product_count") + delta
+        )
+
+
+def change_bucket_count(bucket, delta):
+    if not delta:
+        return
+    updated = PriceBucket.objects.filter(pk=bucket).update(
+        product_count=F("product_count") + delta
+    )
+    if not updated:
+        PriceBucket.objects.get_or_create(pk=bucket, defaults={"product_count": max(delta, 0)})
+
+
+def rebuild_facet_counts():
+    """Полный пересчёт счётчиков, например после массовых изменений в обход сигналов."""
+    category_counts = (
+        ProductCategory.objects.filter(category_id=OuterRef("pk"), product__is_active=True)
+        .order_by()
+        .values("category_id")
+        .annotate(total=Count("product_id"))
+        .values("total")
+    )
+    Category.objects.update(product_count=Coalesce(Subquery(category_counts), 0))
+
+    bucket_counts = dict(
+        Product.objects.active().order_by().values_list("price_bucket").annotate(total=Count("id"))
+    )
+    PriceBucket.objects.bulk_create(
+        [
+            PriceBucket(bucket=index, product_count=bucket_counts.get(index, 0))
+            for index in range(len(PRICE_BUCKETS))
+        ],
+        update_conflicts=True,
+        unique_fields=["bucket"],
+        update_fields=["product_count"],
+    )
+
+
+def price_facets():
+    counts = dict(PriceBucket.objects.values_list("bucket", "product_count"))
+    return [
+        {"bucket": index, "label": label, "count": counts.get(index, 0)}
+        for index, (_, label) in enumerate(PRICE_BUCKETS)
+    ]
+
+
+def filter_by_facets(queryset, category_ids=(), mode="or", buckets=()):
+    if category_ids:
+        if mode == "and":
+            # Подзапрос на каждую категорию вместо JOIN: без дублей и без DISTINCT
+            for category_id in category_ids:
+                queryset = queryset.filter(
+                    pk__in=ProductCategory.objects.filter(category_id=category_id).values("product_id")
+                )
+        else:
+            queryset = queryset.filter(
+                pk__in=ProductCategory.objects.filter(category_id__in=category_ids).values("product_id")
+            )
+    if buckets:
+        queryset = queryset.filter(price_bucket__in=buckets)
+    return queryset
+
@@ -0,0 +1,101 @@
+import csv
+import json
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape, quoteattr
+
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from django.urls import reverse
+
+from .models import Category, Product
+
+CHUNK_SIZE = 2000
+# Строки склеиваются в куски примерно такого размера перед отдачей клиенту или в файл
+BUFFER_SIZE = 64 * 1024
+CURRENCY = "BYN"
+CSV_FIELDS = ["id", "name", "url", "price", "currency", "categories", "image", "description"]
+
+
+def feed_items(base_url, chunk_size=CHUNK_SIZE):
+    """Активные товары по одному, с категориями и абсолютными URL; память не растёт с каталогом."""
+    products = (
+        Product.objects.active()
+        .order_by("pk")
+        .only("pk", "name", "slug", "price", "description", "image")
+        .prefetch_related(Prefetch("categories", queryset=Category.objects.only("name")))
+    )
+    # С chunk_size prefetch выполняется на каждую пачку, а не на всю выборку
+    for product in products.iterator(chunk_size=chunk_size):
+        yield {
+            "id": product.pk,
+            "name": product.name,
+            "url": urljoin(base_url, reverse("product_detail", args=[product.slug])),
+            "price": str(product.price),
+            "currency": CURRENCY,
+            "categories": [category.name for category in product.categories.all()],
+            "image": urljoin(base_url, default_storage.url(product.image.name)) if product.image else "",
+            "description": product.description or "",
+        }
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _buffered(chunks):
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _csv_lines(items):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for item in items:
+        item = {**item, "categories": "; ".join(item["categories"])}
+        yield writer.writerow([item[field] for field in CSV_FIELDS])
+
+
+def _jsonl_lines(items):
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def _xml_lines(items):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<offers>\n'
+    for item in items:
+        categories = "".join(
+            f"<category>{escape(category)}</category>" for category in item["categories"]
+        )
+        yield (
+            f"  <offer id={quoteattr(str(item['id']))}>"
+            f"<name>{escape(item['name'])}</name>"
+            f"<url>{escape(item['url'])}</url>"
+            f"<price>{item['price']}</price>"
+            f"<currencyId>{item['currency']}</currencyId>"
+            f"{categories}"
+            f"<picture>{escape(item['image'])}</picture>"
+            f"<description>{escape(item['description'])}</description>"
+            "</offer>\n"
+        )
+    yield "</offers>\n"
+
+
+FORMATS = {
+    "csv": ("text/csv", _csv_lines),
+    "jsonl": ("application/x-ndjson", _jsonl_lines),
+    "xml": ("application/xml", _xml_lines),
+}
+
+
+def render_feed(fmt, base_url, chunk_size=CHUNK_SIZE):
+    """Генератор строковых кусков выгрузки в формате fmt."""
+    _, lines = FORMATS[fmt]
+    return _buffered(lines(feed_items(base_url, chunk_size)))
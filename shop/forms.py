@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit
@@ -38,8 +40,8 @@ class AddProduct(forms.Form):
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
-        fields = ["text"]
-        labels = {"text": ""}
+        fields = ["text", "rating"]
+        labels = {"text": "", "rating": "Оценка"}
 
 
 class CustomRegister(UserCreationForm):
@@ -65,6 +67,9 @@ class CustomLogin(AuthenticationForm):
 
 
 class OrderConfirm(forms.ModelForm):
+    # Повторная отправка той же формы не создаёт второй заказ
+    checkout_token = forms.UUIDField(widget=forms.HiddenInput, initial=uuid.uuid4)
+
     class Meta:
         model = Order
         fields = [
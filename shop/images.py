@@ -0,0 +1,99 @@
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = getattr(settings, "IMAGE_VARIANT_WIDTHS", [200, 400, 800])
+VARIANT_FORMATS = getattr(settings, "IMAGE_VARIANT_FORMATS", ["webp"])
+VARIANT_QUALITY = getattr(settings, "IMAGE_VARIANT_QUALITY", 80)
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+
+def supported_formats():
+    formats = []
+    for fmt in VARIANT_FORMATS:
+        if features.check(fmt):
+            formats.append(fmt)
+        else:
+            logger.warning("Pillow собран без поддержки %s, варианты не создаются", fmt)
+    return formats
+
+
+def _variant_name(source_name, width, fmt):
+    directory, filename = posixpath.split(source_name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}-{width}w.{fmt}")
+
+
+def build_variants(field_file):
+    """Сохраняет уменьшенные копии изображения и возвращает их описание для JSON-поля."""
+    with field_file.open("rb") as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    # Не увеличиваем картинку: ширины больше исходной заменяются исходной
+    widths = sorted({min(width, image.width) for width in VARIANT_WIDTHS})
+    variants = []
+    for fmt in supported_formats():
+        for width in widths:
+            height = max(round(image.height * width / image.width), 1)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, format=fmt.upper(), quality=VARIANT_QUALITY)
+            name = default_storage.save(
+                _variant_name(field_file.name, width, fmt), ContentFile(buffer.getvalue())
+            )
+            variants.append({"name": name, "format": fmt, "width": width, "height": height})
+    return {"source": field_file.name, "variants": variants}
+
+
+def delete_variants(data):
+    for variant in (data or {}).get("variants", []):
+        default_storage.delete(variant["name"])
+
+
+def variants_outdated(instance, field="image", variants_field="image_variants"):
+    field_file = getattr(instance, field)
+    data = getattr(instance, variants_field) or {}
+    return data.get("source") != (field_file.name or None)
+
+
+def refresh_variants(instance, field="image", variants_field="image_variants", force=False):
+    """Пересоздаёт варианты, если изображение сменилось; сохраняет через update() без сигналов."""
+    if not force and not variants_outdated(instance, field, variants_field):
+        return False
+    field_file = getattr(instance, field)
+    delete_variants(getattr(instance, variants_field))
+    data = {}
+    if field_file:
+        try:
+            data = build_variants(field_file)
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось обработать %s: %s", field_file.name, e)
+            data = {"source": field_file.name, "variants": []}
+    setattr(instance, variants_field, data)
+    changes = {variants_field: data}
+    # auto_now-поля обновляем явно: по ним ключуются закэшированные фрагменты
+    for model_field in instance._meta.concrete_fields:
+        if getattr(model_field, "auto_now", False):
+            changes[model_field.attname] = timezone.now()
+    type(instance).objects.filter(pk=instance.pk).update(**changes)
+    return True
+
+
+def srcset(data, fmt):
+    return ", ".join(
+        f"{default_storage.url(variant['name'])} {variant['width']}w"
+        for variant in (data or {}).get("variants", [])
+        if variant["format"] == fmt
+    )
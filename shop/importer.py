@@ -0,0 +1,307 @@
+import csv
+import json
+import os
+import posixpath
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import cache, facets
+from .jobs import enqueue_many
+from .models import Category, Product, get_price_bucket
+
+ProductCategory = Product.categories.through
+
+NAME_MAX_LENGTH = Product._meta.get_field("name").max_length
+SLUG_MAX_LENGTH = Product._meta.get_field("slug").max_length
+PRICE_MAX = Decimal("99999999.99")
+IMAGE_UPLOAD_TO = Product._meta.get_field("image").upload_to
+# Запасные варианты суффиксов на каждый slug: обычно хватает одного запроса на пачку
+SLUG_SPARE = 2
+
+TRUE_VALUES = {"1", "true", "yes", "y", "да"}
+FALSE_VALUES = {"0", "false", "no", "n", "нет"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Построчно читает поток: CSV отдаёт словари, JSONL — необработанные строки."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield line
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES or value == "":
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f"некорректное значение is_active: {value}")
+
+
+def _suffixed(base, number):
+    if number == 0:
+        return base
+    suffix = f"-{number + 1}"
+    return f"{base[: SLUG_MAX_LENGTH - len(suffix)]}{suffix}"
+
+
+def allocate_slugs(bases):
+    """Уникальные slug для пачки: base, base-2, base-3… с проверкой занятых одним запросом на раунд."""
+    slugs = [None] * len(bases)
+    groups = defaultdict(list)
+    for index, base in enumerate(bases):
+        groups[base].append(index)
+    start = dict.fromkeys(groups, 0)
+    assigned = set()
+    while groups:
+        candidates = {
+            base: [
+                _suffixed(base, number)
+                for number in range(start[base], start[base] + len(indexes) + SLUG_SPARE)
+            ]
+            for base, indexes in groups.items()
+        }
+        taken = set(
+            Product.objects.filter(
+                slug__in=[slug for group in candidates.values() for slug in group]
+            ).values_list("slug", flat=True)
+        )
+        for base, indexes in list(groups.items()):
+            free = [slug for slug in candidates[base] if slug not in taken and slug not in assigned]
+            for index, slug in zip(indexes, free):
+                slugs[index] = slug
+                assigned.add(slug)
+            if len(free) >= len(indexes):
+                del groups[base]
+            else:
+                groups[base] = indexes[len(free):]
+                start[base] += len(candidates[base])
+    return slugs
+
+
+class ProductImporter:
+    def __init__(self, images_dir=None):
+        self.images_dir = os.path.realpath(images_dir) if images_dir else None
+        self.categories = dict(Category.objects.values_list("slug", "id"))
+        self.created = 0
+        self.updated = 0
+
+    def _image_path(self, name):
+        if not self.images_dir:
+            raise RowError("указано изображение, но не задан --images-dir")
+        path = os.path.realpath(os.path.join(self.images_dir, name))
+        if os.path.commonpath([path, self.images_dir]) != self.images_dir:
+            raise RowError(f"изображение вне каталога: {name}")
+        if not os.path.isfile(path):
+            raise RowError(f"нет файла изображения: {name}")
+        return path
+
+    def clean(self, raw):
+        """Проверяет строку и приводит её к словарю полей; при ошибке — RowError."""
+        if isinstance(raw, str):
+            try:
+                raw = json.loads(raw)
+            except ValueError as e:
+                raise RowError(f"некорректный JSON: {e}")
+        if not isinstance(raw, dict):
+            raise RowError("ожидается объект")
+
+        name = str(raw.get("name") or "").strip()
+        if not name:
+            raise RowError("не указано название")
+        if len(name) > NAME_MAX_LENGTH:
+            raise RowError(f"название длиннее {NAME_MAX_LENGTH} символов")
+
+        try:
+            price = Decimal(str(raw.get("price", "")).strip().replace(",", "."))
+        except InvalidOperation:
+            raise RowError(f"некорректная цена: {raw.get('price')}")
+        if not price.is_finite() or not 0 <= price <= PRICE_MAX:
+            raise RowError(f"некорректная цена: {raw.get('price')}")
+
+        categories = raw.get("categories") or []
+        if isinstance(categories, str):
+            categories = [slug.strip() for slug in categories.split(";") if slug.strip()]
+        if not isinstance(categories, list) or not all(isinstance(slug, str) for slug in categories):
+            raise RowError("categories: ожидается строка slug через ; или список строк")
+        unknown = [slug for slug in categories if slug not in self.categories]
+        if unknown:
+            raise RowError(f"неизвестные категории: {', '.join(map(str, unknown))}")
+
+        image = str(raw.get("image") or "").strip()
+        given_slug = str(raw.get("slug") or "").strip()
+        slug = slugify(given_slug or name)[:SLUG_MAX_LENGTH].strip("-")
+        return {
+            "name": name,
+            "price": price.quantize(Decimal("0.01")),
+            "description": str(raw.get("description") or ""),
+            "slug": slug or "product",
+            # Явный slug — ключ товара: такая строка обновляет существующий товар
+            "upsert": bool(given_slug and slug),
+            "category_ids": {self.categories[slug] for slug in categories},
+            "image": self._image_path(image) if image else None,
+            "is_active": _parse_bool(raw.get("is_active", True)),
+        }
+
+    def _image_name(self, path):
+        # Свободное сейчас имя; файл пишется только после коммита пачки, см. _store_images
+        return default_storage.get_available_name(
+            posixpath.join(IMAGE_UPLOAD_TO, os.path.basename(path))
+        )
+
+    def _store_images(self, images):
+        """Копирует изображения в хранилище после коммита: откат пачки не оставит файлов.
+
+        images — пары (товар, путь к исходнику). Если имя успели занять (или оно повторилось
+        в пачке), хранилище выдаёт другое, и товар переводится на него. После записи файлов
+        ставятся задачи на варианты изображений.
+        """
+        renamed = []
+        for product, path in images:
+            with open(path, "rb") as source:
+                name = default_storage.save(product.image.name, File(source))
+            if name != product.image.name:
+                product.image = name
+                renamed.append(product)
+        if renamed:
+            now = timezone.now()
+            for product in renamed:
+                product.updated_at = now
+            Product.objects.bulk_update(renamed, ["image", "updated_at"])
+            cache.bump("catalog")
+        enqueue_many(
+            "images.build_variants", [{"model": "shop.product", "pk": product.pk} for product, _ in images]
+        )
+
+    def import_chunk(self, rows):
+        """Сохраняет проверенные строки одной транзакцией: товары, связи, счётчики.
+
+        Строки с явным slug существующего товара обновляют его, поэтому повторный импорт
+        того же файла не создаёт копий; повтор slug в пачке даёт один товар. Изображения
+        и задачи на их варианты пишутся после коммита. Возвращает созданные товары.
+        """
+        if not rows:
+            return []
+        # Повтор явного slug внутри пачки: остаётся последняя строка, как при построчной записи
+        last = {row["slug"]: index for index, row in enumerate(rows) if row["upsert"]}
+        rows = [row for index, row in enumerate(rows) if not row["upsert"] or last[row["slug"]] == index]
+        with transaction.atomic():
+            existing = Product.objects.select_for_update().in_bulk(
+                [row["slug"] for row in rows if row["upsert"]], field_name="slug"
+            )
+            updates = {row["slug"]: row for row in rows if row["upsert"] and row["slug"] in existing}
+            rows = [row for row in rows if not (row["upsert"] and row["slug"] in existing)]
+            updated = self._update_existing(existing, updates)
+
+            slugs = allocate_slugs([row["slug"] for row in rows])
+            products = []
+            for row, slug in zip(rows, slugs):
+                product = Product(
+                    name=row["name"],
+                    price=row["price"],
+                    description=row["description"],
+                    slug=slug,
+                    is_active=row["is_active"],
+                    price_bucket=get_price_bucket(row["price"]),
+                )
+                if row["image"]:
+                    product.image = self._image_name(row["image"])
+                products.append(product)
+            Product.objects.bulk_create(products)
+            if any(product.pk is None for product in products):
+                # Бэкенд без RETURNING: id находим по только что выданным slug
+                ids = dict(Product.objects.filter(slug__in=slugs).values_list("slug", "id"))
+                for product in products:
+                    product.pk = ids[product.slug]
+
+            ProductCategory.objects.bulk_create(
+                [
+                    ProductCategory(product_id=product.pk, category_id=category_id)
+                    for product, row in zip(products, rows)
+                    for category_id in row["category_ids"]
+                ]
+            )
+            self._update_facets(products, rows)
+            images = [
+                (product, row["image"])
+                for product, row in [*zip(products, rows), *updated]
+                if row["image"]
+            ]
+            if images:
+                transaction.on_commit(lambda: self._store_images(images))
+        # bulk_create и bulk_update обходят сигналы: сбрасываем кэш каталога сами
+        cache.bump("catalog")
+        self.created += len(products)
+        self.updated += len(updated)
+        return products
+
+    def _update_existing(self, existing, updates):
+        """Обновляет товары по slug; возвращает пары (товар, строка)."""
+        if not updates:
+            return []
+        products = [existing[slug] for slug in updates]
+        old_categories = defaultdict(set)
+        for product_id, category_id in ProductCategory.objects.filter(
+            product__in=products
+        ).values_list("product_id", "category_id"):
+            old_categories[product_id].add(category_id)
+        # Сначала снимаем вклад старых значений в счётчики фильтров, потом добавляем новый
+        self._update_facets(
+            products, [{"category_ids": old_categories[product.pk]} for product in products], sign=-1
+        )
+
+        now = timezone.now()
+        for product, row in zip(products, updates.values()):
+            product.name = row["name"]
+            product.price = row["price"]
+            product.description = row["description"]
+            product.is_active = row["is_active"]
+            product.price_bucket = get_price_bucket(row["price"])
+            # Карточки кэшируются по updated_at, а auto_now в bulk_update не срабатывает
+            product.updated_at = now
+            if row["image"]:
+                product.image = self._image_name(row["image"])
+        Product.objects.bulk_update(
+            products,
+            ["name", "price", "description", "is_active", "price_bucket", "updated_at", "image"],
+        )
+        ProductCategory.objects.filter(product__in=products).delete()
+        ProductCategory.objects.bulk_create(
+            [
+                ProductCategory(product_id=product.pk, category_id=category_id)
+                for product, row in zip(products, updates.values())
+                for category_id in row["category_ids"]
+            ]
+        )
+        self._update_facets(products, list(updates.values()))
+        return list(zip(products, updates.values()))
+
+    def _update_facets(self, products, rows, sign=1):
+        category_counts = Counter()
+        bucket_counts = Counter()
+        for product, row in zip(products, rows):
+            if product.is_active:
+                category_counts.update(row["category_ids"])
+                bucket_counts[product.price_bucket] += 1
+        by_delta = defaultdict(list)
+        for category_id, count in category_counts.items():
+            by_delta[count].append(category_id)
+        for count, category_ids in by_delta.items():
+            facets.change_category_counts(category_ids, sign * count)
+        for bucket, count in bucket_counts.items():
+            facets.change_bucket_count(bucket, sign * count)
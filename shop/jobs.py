@@ -0,0 +1,151 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RUN_EAGERLY = getattr(settings, "JOBS_RUN_EAGERLY", False)
+VISIBILITY_TIMEOUT = getattr(settings, "JOBS_VISIBILITY_TIMEOUT", 300)
+RETRY_BACKOFF = getattr(settings, "JOBS_RETRY_BACKOFF", 10)
+RETRY_BACKOFF_MAX = getattr(settings, "JOBS_RETRY_BACKOFF_MAX", 3600)
+
+registry = {}
+
+
+class UnknownJob(LookupError):
+    pass
+
+
+def task(name):
+    """Регистрирует функцию как фоновую задачу с именем name."""
+
+    def decorator(func):
+        registry[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, payload=None, *, priority=0, delay=None, max_attempts=None):
+    """Ставит задачу в очередь в текущей транзакции: откат отменит и задачу."""
+    if name not in registry:
+        raise UnknownJob(name)
+    job = Job(name=name, payload=payload or {}, priority=priority)
+    if delay:
+        job.run_at = timezone.now() + timedelta(seconds=delay)
+    if max_attempts:
+        job.max_attempts = max_attempts
+    job.save()
+    if RUN_EAGERLY:
+        transaction.on_commit(lambda: run_pending(job_ids=[job.pk]))
+    return job
+
+
+def enqueue_many(name, payloads, *, priority=0, max_attempts=None):
+    """Как enqueue(), но одним INSERT для пачки задач, например при импорте."""
+    if name not in registry:
+        raise UnknownJob(name)
+    jobs = [Job(name=name, payload=payload, priority=priority) for payload in payloads]
+    if max_attempts:
+        for job in jobs:
+            job.max_attempts = max_attempts
+    jobs = Job.objects.bulk_create(jobs)
+    if RUN_EAGERLY and jobs:
+        job_ids = [job.pk for job in jobs]
+        transaction.on_commit(lambda: run_pending(job_ids=job_ids))
+    return jobs
+
+
+def _available(now):
+    # Выполняющиеся задачи с истёкшей блокировкой считаются потерянными и забираются снова
+    return Q(status="queued", run_at__lte=now) | Q(status="running", locked_until__lt=now)
+
+
+def claim(worker_id, limit, visibility_timeout=VISIBILITY_TIMEOUT, job_ids=None):
+    now = timezone.now()
+    available = Job.objects.filter(_available(now))
+    if job_ids is not None:
+        available = available.filter(pk__in=job_ids)
+    ordered = available.order_by("-priority", "run_at", "id")
+    claimed = {
+        "status": "running",
+        "locked_by": worker_id,
+        "locked_until": now + timedelta(seconds=visibility_timeout),
+        "attempts": F("attempts") + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                ordered.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit]
+            )
+            Job.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        # SQLite: без SKIP LOCKED, но запись сериализована, а условие повторяется в UPDATE —
+        # строку, которую успел забрать другой воркер, второй UPDATE не затронет
+        ids = list(ordered.values_list("id", flat=True)[:limit])
+        available.filter(pk__in=ids).update(**claimed)
+    return list(
+        Job.objects.filter(pk__in=ids, locked_by=worker_id, status="running").order_by(
+            "-priority", "run_at", "id"
+        )
+    )
+
+
+def _backoff(attempts):
+    delay = min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def execute(job):
+    """Выполняет захваченную задачу и записывает результат."""
+    try:
+        func = registry.get(job.name)
+        if func is None:
+            raise UnknownJob(job.name)
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Задача #%s %s завершилась ошибкой", job.pk, job.name, exc_info=True)
+        now = timezone.now()
+        update = {"last_error": error, "locked_by": "", "locked_until": None}
+        if job.attempts >= job.max_attempts:
+            update.update(status="failed", finished_at=now)
+        else:
+            update.update(status="queued", run_at=now + timedelta(seconds=_backoff(job.attempts)))
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**update)
+        return False
+    else:
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            status="done", finished_at=timezone.now(), locked_by="", locked_until=None
+        )
+        return True
+
+
+def execute_in_worker(job_id, worker_id):
+    """Точка входа для пула потоков или процессов воркера."""
+    close_old_connections()
+    try:
+        job = Job.objects.filter(pk=job_id, locked_by=worker_id, status="running").first()
+        return execute(job) if job else False
+    finally:
+        close_old_connections()
+
+
+def run_pending(worker_id="inline", limit=100, job_ids=None):
+    """Синхронно выполняет доступные задачи; для тестов и режима JOBS_RUN_EAGERLY."""
+    done = 0
+    while True:
+        jobs = claim(worker_id, limit, job_ids=job_ids)
+        if not jobs:
+            return done
+        for job in jobs:
+            execute(job)
+            done += 1
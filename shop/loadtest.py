@@ -0,0 +1,267 @@
+import http.cookiejar
+import logging
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import namedtuple
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, Order, Product
+
+logger = logging.getLogger(__name__)
+
+USER_PREFIX = "loadtest"
+# Пароль пользователей loadtest* нужен только для --url (вход через форму). Без него
+# пользователи создаются с непригодным паролем и войти под ними нельзя
+PASSWORD = getattr(settings, "LOADTEST_PASSWORD", None)
+ORDER_DATA = {
+    "first_name": "Нагрузочный",
+    "last_name": "Тест",
+    "email": "loadtest@example.com",
+    "phone": "+375291234567",
+    "address_street": "Тестовая",
+    "address_building": "1",
+}
+ORDER_URL = re.compile(r"/order/(\d+)/")
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+# Статус для оформления, которое не привело к заказу (например, форма не прошла проверку)
+CHECKOUT_FAILED = 599
+
+Result = namedtuple("Result", ["status", "location", "seconds", "queries"])
+
+
+class InProcessSession:
+    """Запросы через тестовый клиент Django в том же процессе; считает SQL-запросы."""
+
+    def __init__(self, user):
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+
+    def request(self, method, path, data=None):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method.lower())(path, data or {})
+        elapsed = time.perf_counter() - started
+        return Result(response.status_code, response.get("Location", ""), elapsed, len(queries))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """Запросы к запущенному серверу по HTTP; число SQL-запросов берётся из Server-Timing."""
+
+    def __init__(self, base_url, user, password):
+        self.base_url = base_url
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect
+        )
+        self.request("GET", reverse("login"))
+        self.request("POST", reverse("login"), {"username": user.username, "password": password})
+
+    def _csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == "csrftoken"), "")
+
+    def request(self, method, path, data=None):
+        url = urllib.parse.urljoin(self.base_url, path)
+        body = None
+        headers = {"Referer": url}
+        if method == "POST":
+            body = urllib.parse.urlencode(data or {}).encode()
+            headers["X-CSRFToken"] = self._csrf_token()
+        request = urllib.request.Request(url, data=body, method=method, headers=headers)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, e.headers
+        elapsed = time.perf_counter() - started
+        match = SERVER_TIMING_QUERIES.search(headers.get("Server-Timing", ""))
+        queries = int(match.group(1)) if match else None
+        return Result(status, headers.get("Location", ""), elapsed, queries)
+
+
+def _browse(session, catalog, rng, record):
+    record("index", session.request("GET", reverse("index")))
+    category = rng.choice(catalog["categories"])
+    record("category", session.request("GET", reverse("category_products", args=[category])))
+    product = rng.choice(catalog["products"])
+    record("product", session.request("GET", reverse("product_detail", args=[product])))
+    return product
+
+
+def _shop(session, catalog, rng, record):
+    product = _browse(session, catalog, rng, record)
+    record("add_to_cart", session.request("POST", reverse("add_to_cart", args=[product])))
+    record("cart", session.request("GET", reverse("cart")))
+
+
+def _buy(session, catalog, rng, record):
+    _shop(session, catalog, rng, record)
+    data = {**ORDER_DATA, "checkout_token": uuid.uuid4()}
+    result = session.request("POST", reverse("cart"), data)
+    # Успешное оформление перенаправляет на страницу заказа /order/<pk>/
+    match = ORDER_URL.search(result.location) if result.status == 302 else None
+    if match is None:
+        result = result._replace(status=CHECKOUT_FAILED)
+    record("checkout", result)
+    if match:
+        record("pay", session.request("POST", reverse("pay", args=[int(match.group(1))])))
+
+
+JOURNEYS = {"browse": _browse, "cart": _shop, "checkout": _buy}
+DEFAULT_MIX = {"browse": 70, "cart": 20, "checkout": 10}
+
+
+def loadtest_users(count, password=None):
+    """Пользователи loadtest0..N-1; создаются при первом запуске.
+
+    Пароль задаётся при каждом запуске: без password он непригоден для входа, так что
+    оставшиеся в базе учётные записи не открывают доступ по известному паролю.
+    """
+    users = []
+    for i in range(count):
+        user, _ = User.objects.get_or_create(
+            username=f"{USER_PREFIX}{i}", defaults={"email": f"{USER_PREFIX}{i}@example.com"}
+        )
+        if password:
+            user.set_password(password)
+        else:
+            user.set_unusable_password()
+        user.save(update_fields=["password"])
+        users.append(user)
+    return users
+
+
+def cleanup():
+    """Удаляет заказы, оформленные нагрузочными пользователями."""
+    return Order.objects.filter(user__username__startswith=USER_PREFIX).delete()[0]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def _summary(samples, elapsed):
+    latencies = [round(sample["seconds"] * 1000, 2) for sample in samples]
+    queries = [sample["queries"] for sample in samples if sample["queries"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample["status"] >= 400),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": max(latencies, default=None),
+        "queries_p50": _percentile(queries, 50),
+        "queries_max": max(queries, default=None),
+    }
+
+
+def run(*, base_url=None, workers=4, duration=30.0, iterations=None, mix=None, seed=None):
+    """Гоняет сценарии в workers потоках и возвращает отчёт в виде словаря.
+
+    Без base_url запросы идут через тестовый клиент в этом процессе, иначе — по HTTP
+    на запущенный сервер. Останавливается по duration секунд или после iterations
+    сценариев на поток.
+    """
+    mix = mix or DEFAULT_MIX
+    catalog = {
+        "categories": list(Category.objects.values_list("slug", flat=True)),
+        "products": list(Product.objects.active().values_list("slug", flat=True)),
+    }
+    if not catalog["categories"] or not catalog["products"]:
+        raise ValueError("Для нагрузочного теста нужны категории и активные товары")
+    if base_url and not PASSWORD:
+        raise ValueError("Для --url задайте пароль пользователей loadtest* в LOADTEST_PASSWORD")
+    users = loadtest_users(workers, PASSWORD if base_url else None)
+    names, weights = list(mix), list(mix.values())
+    samples, lock = [], threading.Lock()
+    # Исключения вне ответа сервера (обрыв соединения, ошибка в сценарии) по сценариям;
+    # login — потоки, которые не смогли начать сессию
+    failures = dict.fromkeys([*names, "login"], 0)
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        rng = random.Random(None if seed is None else seed + number)
+        own = []
+
+        def record(view, result):
+            own.append({"view": view, **result._asdict()})
+
+        try:
+            try:
+                if base_url:
+                    session = HttpSession(base_url, users[number], PASSWORD)
+                else:
+                    session = InProcessSession(users[number])
+            except Exception:
+                logger.exception("Поток %s не смог войти и не выполнил ни одного сценария", number)
+                with lock:
+                    failures["login"] += 1
+                return
+            done = 0
+            while done < iterations if iterations else time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                try:
+                    JOURNEYS[name](session, catalog, rng, record)
+                except Exception:
+                    logger.exception("Сценарий %s завершился ошибкой", name)
+                    with lock:
+                        failures[name] += 1
+                done += 1
+        finally:
+            with lock:
+                samples.extend(own)
+            # У каждого потока своё соединение с БД
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(workers)]
+    # Тестовый клиент ходит с Host: testserver
+    hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"])
+    started_at = timezone.now()
+    begin = time.perf_counter()
+    with hosts if not base_url else nullcontext():
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - begin
+
+    views = {}
+    for sample in samples:
+        views.setdefault(sample["view"], []).append(sample)
+    total = _summary(samples, elapsed)
+    total["errors"] += sum(failures.values())
+    return {
+        "started_at": started_at.isoformat(),
+        "mode": "http" if base_url else "in-process",
+        "base_url": base_url,
+        "workers": workers,
+        "mix": mix,
+        "elapsed_s": round(elapsed, 2),
+        "total": total,
+        "journey_errors": failures,
+        "views": {view: _summary(view_samples, elapsed) for view, view_samples in sorted(views.items())},
+    }
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as page_cache
+from shop.images import refresh_variants
+from shop.models import Comment, Product
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные WebP/AVIF-копии для уже загруженных изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Пересоздать варианты, даже если они актуальны"
+        )
+
+    def handle(self, *args, **options):
+        # Поколения кэша страниц, которые показывают изменённые изображения
+        groups = (
+            (Product, (), lambda product: "catalog"),
+            (Comment, ("product_id",), lambda comment: f"comments:{comment.product_id}"),
+        )
+        for model, fields, generation in groups:
+            processed = 0
+            stale = set()
+            queryset = model.objects.exclude(image="").exclude(image__isnull=True).only(
+                "pk", "image", "image_variants", *fields
+            )
+            for instance in queryset.iterator(chunk_size=200):
+                if refresh_variants(instance, force=options["force"]):
+                    processed += 1
+                    stale.add(generation(instance))
+            # refresh_variants пишет через update() в обход сигналов
+            page_cache.bump(*stale)
+            self.stdout.write(f"{model._meta.verbose_name_plural}: обработано {processed}")
+        self.stdout.write(self.style.SUCCESS("Готово"))
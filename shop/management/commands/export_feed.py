@@ -0,0 +1,38 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.feeds import CHUNK_SIZE, FORMATS, render_feed
+
+
+class Command(BaseCommand):
+    help = "Выгружает активные товары для маркетплейсов в CSV, JSONL или XML; *.gz сжимается"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(FORMATS), default="xml")
+        parser.add_argument("--output", default="-", help="Путь к файлу или - для stdout")
+        parser.add_argument(
+            "--base-url",
+            default=getattr(settings, "SITE_URL", "http://localhost:8000/"),
+            help="Адрес сайта для абсолютных ссылок",
+        )
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = render_feed(options["format"], options["base_url"], options["chunk_size"])
+        output = options["output"]
+        if output == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        # Пишем во временный файл и подменяем: потребитель не увидит выгрузку наполовину
+        tmp = f"{output}.tmp"
+        opener = gzip.open if output.endswith(".gz") else open
+        with opener(tmp, "wt", encoding="utf-8", newline="") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, output)
+        self.stdout.write(self.style.SUCCESS(f"Выгрузка сохранена в {output}"))
@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.importer import ProductImporter, RowError, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Потоково импортирует товары из CSV или JSONL (файл или stdin). "
+        "Поля: name, price, description, slug, categories (slug через ;), image, is_active. "
+        "Строка с slug существующего товара обновляет его"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Путь к файлу или - для stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="По умолчанию — по расширению")
+        parser.add_argument("--images-dir", help="Каталог с файлами из колонки image")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Строк на транзакцию")
+        parser.add_argument(
+            "--progress-file",
+            help="Файл прогресса для продолжения после сбоя; по умолчанию <source>.progress",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Начать с начала, игнорируя сохранённый прогресс"
+        )
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        fmt = options["format"] or ("jsonl" if source.endswith((".jsonl", ".ndjson")) else "csv")
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size должен быть положительным")
+        progress_file = options["progress_file"] or (None if source == "-" else f"{source}.progress")
+
+        progress = {"rows": 0, "created": 0, "updated": 0, "errors": 0}
+        if progress_file and os.path.exists(progress_file) and not options["restart"]:
+            with open(progress_file, encoding="utf-8") as f:
+                progress.update(json.load(f))
+            if progress.get("finished"):
+                self.stdout.write("Файл уже импортирован; --restart начнёт заново")
+                return
+            self.stdout.write(f"Продолжение со строки {progress['rows'] + 1}")
+
+        try:
+            stream = sys.stdin if source == "-" else open(source, encoding="utf-8-sig", newline="")
+        except OSError as e:
+            raise CommandError(e)
+
+        importer = ProductImporter(options["images_dir"])
+        started = time.monotonic()
+        skip = progress["rows"]
+        chunk = []
+        number = skip
+        try:
+            for number, raw in enumerate(read_rows(stream, fmt), 1):
+                if number <= skip:
+                    continue
+                try:
+                    chunk.append(importer.clean(raw))
+                except RowError as e:
+                    progress["errors"] += 1
+                    self.stderr.write(f"Строка {number}: {e}")
+                if number - progress["rows"] >= chunk_size:
+                    self._flush(importer, chunk, number, progress, progress_file, started, skip)
+                    chunk = []
+            self._flush(importer, chunk, number, progress, progress_file, started, skip, finished=True)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Готово: создано {progress['created']}, обновлено {progress['updated']}, "
+                f"ошибок {progress['errors']}"
+            )
+        )
+
+    def _flush(self, importer, chunk, number, progress, progress_file, started, skip, finished=False):
+        updated = importer.updated
+        created = importer.import_chunk(chunk)
+        progress["rows"] = number
+        progress["created"] += len(created)
+        progress["updated"] += importer.updated - updated
+        if finished:
+            progress["finished"] = True
+        if progress_file:
+            # Прогресс пишется только после коммита пачки и заменяется атомарно
+            tmp = f"{progress_file}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(progress, f)
+            os.replace(tmp, progress_file)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            f"Строк: {number}, создано: {progress['created']}, обновлено: {progress['updated']}, "
+            f"{(number - skip) / elapsed:.0f} строк/с"
+        )
@@ -0,0 +1,100 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import loadtest
+
+
+def _mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in loadtest.JOURNEYS or not weight.isdigit():
+            raise ValueError(part)
+        mix[name] = int(weight)
+    return mix
+
+
+def _debug():
+    # DEBUG может прийти строкой из окружения, и "False" была бы истиной
+    if isinstance(settings.DEBUG, str):
+        return settings.DEBUG.lower() in ("1", "true", "yes", "on")
+    return bool(settings.DEBUG)
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест: сценарии просмотра, корзины и оформления заказа в нескольких потоках. "
+        "Пишет в JSON rps, p50/p95/p99 и число SQL-запросов по каждому представлению. "
+        "Создаёт пользователей loadtest* и заказы — запускайте на тестовой базе. "
+        "Без DEBUG требует --i-know"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="Адрес запущенного сервера; без него запросы идут в этом процессе")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--duration", type=float, default=30, help="Секунды")
+        parser.add_argument("--iterations", type=int, help="Сценариев на поток вместо --duration")
+        parser.add_argument(
+            "--mix",
+            type=_mix,
+            default=loadtest.DEFAULT_MIX,
+            help="Доли сценариев, например browse=70,cart=20,checkout=10",
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--output", default="-", help="Файл для отчёта или - для stdout")
+        parser.add_argument("--baseline", help="Отчёт прошлого запуска для сравнения")
+        parser.add_argument("--cleanup", action="store_true", help="Удалить созданные заказы после теста")
+        parser.add_argument(
+            "--i-know",
+            action="store_true",
+            help="Запуск без DEBUG: подтверждение, что база не боевая",
+        )
+
+    def handle(self, *args, **options):
+        if not _debug() and not options["i_know"]:
+            raise CommandError(
+                "Тест создаёт пользователей и заказы в текущей базе. Включите DEBUG "
+                "или подтвердите запуск флагом --i-know"
+            )
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                baseline = json.load(f)
+
+        try:
+            report = loadtest.run(
+                base_url=options["url"],
+                workers=options["workers"],
+                duration=options["duration"],
+                iterations=options["iterations"],
+                mix=options["mix"],
+                seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        if options["cleanup"]:
+            self.stderr.write(f"Удалено заказов: {loadtest.cleanup()}")
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(text)
+        else:
+            tmp = f"{options['output']}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, options["output"])
+
+        self.stderr.write(f"{'view':<12} {'req':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>4}")
+        for view, stats in [*report["views"].items(), ("total", report["total"])]:
+            line = (
+                f"{view:<12} {stats['requests']:>6} {stats['errors']:>4} {stats['rps'] or '-':>8} "
+                f"{stats['p50_ms'] or '-':>8} {stats['p95_ms'] or '-':>8} {stats['p99_ms'] or '-':>8} "
+                f"{stats['queries_max'] or '-':>4}"
+            )
+            old = baseline and (baseline["views"].get(view) if view != "total" else baseline["total"])
+            if old and old["p95_ms"] and stats["p95_ms"] is not None:
+                line += f"  p95 {(stats['p95_ms'] - old['p95_ms']) / old['p95_ms']:+.0%}"
+            self.stderr.write(line)
@@ -0,0 +1,49 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.changefeed import BATCH_SIZE, SETTLE_LAG, order_changes
+from shop.pagination import InvalidCursor
+
+
+class Command(BaseCommand):
+    help = (
+        "Выводит в JSONL заказы, изменённые после курсора. "
+        "С --cursor-file курсор читается и сохраняется между запусками"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cursor", help="Курсор предыдущей выгрузки")
+        parser.add_argument("--cursor-file", help="Файл, где хранится курсор между запусками")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--settle-lag", type=int, default=SETTLE_LAG, help="Секунды")
+
+    def handle(self, *args, **options):
+        cursor_file = options["cursor_file"]
+        cursor = options["cursor"]
+        if cursor is None and cursor_file and os.path.exists(cursor_file):
+            with open(cursor_file, encoding="utf-8") as f:
+                cursor = f.read().strip() or None
+
+        total = 0
+        while True:
+            try:
+                batch = order_changes(cursor, options["batch_size"], options["settle_lag"])
+            except InvalidCursor:
+                raise CommandError(f"Некорректный курсор: {cursor}")
+            for order in batch["orders"]:
+                self.stdout.write(json.dumps(order, ensure_ascii=False))
+            self.stdout.flush()
+            cursor = batch["cursor"]
+            total += len(batch["orders"])
+            # Курсор сохраняется только после вывода пачки: при сбое она придёт повторно
+            if cursor_file and cursor:
+                tmp = f"{cursor_file}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(cursor)
+                os.replace(tmp, cursor_file)
+            if not batch["has_more"]:
+                break
+
+        self.stderr.write(f"Заказов: {total}, курсор: {cursor or '-'}")
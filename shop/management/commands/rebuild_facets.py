@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as page_cache
+from shop.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики товаров по категориям и ценовым диапазонам"
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        # UPDATE в обход сигналов: счётчики в кэше каталога и его ETag устарели
+        page_cache.bump("catalog")
+        self.stdout.write(self.style.SUCCESS("Счётчики фильтров пересчитаны"))
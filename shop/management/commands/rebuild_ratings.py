@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as page_cache
+from shop.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает оценки товаров по комментариям, если счётчики разошлись с данными"
+
+    def handle(self, *args, **options):
+        rebuild_ratings()
+        # UPDATE в обход сигналов: сортировка по рейтингу в кэше каталога устарела
+        page_cache.bump("catalog")
+        self.stdout.write(self.style.SUCCESS("Оценки товаров пересчитаны"))
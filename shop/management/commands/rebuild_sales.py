@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shop.analytics import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сводки продаж по заказам, например после загрузки старых данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Первый день периода, ГГГГ-ММ-ДД")
+        parser.add_argument("--until", help="Последний день периода, ГГГГ-ММ-ДД")
+
+    def handle(self, *args, **options):
+        bounds = {}
+        for name in ("since", "until"):
+            if options[name]:
+                bounds[name] = parse_date(options[name])
+                if bounds[name] is None:
+                    raise CommandError(f"Некорректная дата --{name}: {options[name]}")
+        days = rebuild_sales(**bounds)
+        self.stdout.write(self.style.SUCCESS(f"Сводки пересчитаны, дней с продажами: {days}"))
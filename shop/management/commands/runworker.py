@@ -0,0 +1,82 @@
+import os
+import signal
+import socket
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.jobs import VISIBILITY_TIMEOUT, claim, execute_in_worker
+
+
+def _init_process():
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Запускает воркер фоновых задач из таблицы shop_job"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=4, help="Размер пула")
+        parser.add_argument(
+            "--processes", action="store_true", help="Пул процессов вместо пула потоков"
+        )
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Секунды между опросами")
+        parser.add_argument("--visibility-timeout", type=int, default=VISIBILITY_TIMEOUT)
+        parser.add_argument(
+            "--once", action="store_true", help="Выполнить доступные задачи и завершиться"
+        )
+
+    def handle(self, *args, **options):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        concurrency = options["concurrency"]
+        if options["processes"]:
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=concurrency, initializer=_init_process)
+        else:
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        self.stdout.write(f"Воркер {worker_id} запущен, пул: {concurrency}")
+
+        running = set()
+        try:
+            while not self.stopping:
+                free = concurrency - len(running)
+                jobs = []
+                if free > 0:
+                    jobs = claim(
+                        worker_id,
+                        min(free, options["batch_size"]),
+                        visibility_timeout=options["visibility_timeout"],
+                    )
+                for job in jobs:
+                    running.add(pool.submit(execute_in_worker, job.pk, worker_id))
+                if jobs:
+                    continue
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                done, running = wait(
+                    running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is not None:
+                        self.stderr.write(f"Сбой воркера: {future.exception()!r}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Незавершённые задачи вернутся в очередь по истечении visibility timeout
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.stdout.write("Воркер остановлен")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
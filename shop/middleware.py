@@ -0,0 +1,149 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import profiling
+from .cart import COOKIE_NAME as CART_COOKIE_NAME
+from .nplusone import Detector, NPlusOneDetected, format_problems
+from .timing import RequestTiming, current, wrap_connections
+
+logger = logging.getLogger("shop.timing")
+logger_nplusone = logging.getLogger("shop.nplusone")
+
+SERVER_TIMING_HEADER = getattr(settings, "SERVER_TIMING_HEADER", True)
+# Запросы дольше порога (мс) пишутся в лог с самыми дорогими SQL и местами их вызова
+SLOW_REQUEST_MS = getattr(settings, "SLOW_REQUEST_MS", 500)
+SLOW_REQUEST_TOP_SQL = getattr(settings, "SLOW_REQUEST_TOP_SQL", 5)
+# Место вызова ищется у SQL дольше порога (мс) и у всех SQL уже медленного запроса
+SLOW_QUERY_MS = getattr(settings, "SLOW_QUERY_MS", 100)
+# off, log или raise; в production — log с малой долей проверяемых запросов
+NPLUSONE_MODE = getattr(settings, "NPLUSONE_MODE", "off")
+NPLUSONE_SAMPLE_RATE = getattr(settings, "NPLUSONE_SAMPLE_RATE", 1.0)
+
+
+class ServerTimingMiddleware:
+    """Время SQL, шаблонов и всего запроса в заголовке Server-Timing и в логе shop.timing.
+
+    Ставится первым в MIDDLEWARE, чтобы app включал остальные middleware. У потоковых
+    ответов учитывается только работа до начала отдачи тела.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = RequestTiming(slow_after=SLOW_REQUEST_MS / 1000, slow_query=SLOW_QUERY_MS / 1000)
+        token = current.set(timing)
+        try:
+            with wrap_connections(timing):
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+
+        elapsed = timing.elapsed
+        if SERVER_TIMING_HEADER:
+            response["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={timing.sql_time * 1000:.1f};desc="{len(timing.queries)} queries"',
+                    f"tpl;dur={timing.template_time * 1000:.1f}",
+                    f'cache;desc="hit={timing.cache_hits} miss={timing.cache_misses}"',
+                    f"app;dur={elapsed * 1000:.1f}",
+                ]
+            )
+
+        slow = elapsed * 1000 >= SLOW_REQUEST_MS
+        level = logging.WARNING if slow else logging.INFO
+        if logger.isEnabledFor(level):
+            # Только если пользователь уже загружен: иначе лог добавил бы запросы к сессии
+            user = getattr(request, "_cached_user", None)
+            record = {
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "view": getattr(request.resolver_match, "view_name", None),
+                "user": user.pk if user is not None and user.is_authenticated else None,
+                "ms": round(elapsed * 1000, 1),
+                "db_ms": round(timing.sql_time * 1000, 1),
+                "queries": len(timing.queries),
+                "tpl_ms": round(timing.template_time * 1000, 1),
+                "cache_hits": timing.cache_hits,
+                "cache_misses": timing.cache_misses,
+            }
+            if slow:
+                record["top_sql"] = timing.top_queries(SLOW_REQUEST_TOP_SQL)
+            logger.log(level, json.dumps(record, ensure_ascii=False), extra={"timing": record})
+        return response
+
+
+class NPlusOneMiddleware:
+    """Ищет N+1 в доле NPLUSONE_SAMPLE_RATE запросов.
+
+    В режиме log пишет находки в лог shop.nplusone, в режиме raise превращает ответ
+    в ошибку, чтобы при разработке их нельзя было пропустить.
+    """
+
+    def __init__(self, get_response):
+        if NPLUSONE_MODE == "off":
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= NPLUSONE_SAMPLE_RATE:
+            return self.get_response(request)
+        with wrap_connections(Detector()) as detector:
+            response = self.get_response(request)
+        problems = detector.problems()
+        if problems:
+            if NPLUSONE_MODE == "raise":
+                raise NPlusOneDetected(problems)
+            logger_nplusone.warning(
+                "%s %s\n%s",
+                request.method,
+                request.path,
+                format_problems(problems),
+                extra={"nplusone": problems},
+            )
+        return response
+
+
+class ProfilerMiddleware:
+    """Профиль запроса для сотрудников: ?_profile или заголовок X-Profile.
+
+    Значение sample (или пустое) — сэмплирующий профилировщик, файл collapsed stacks;
+    cprofile — детерминированный cProfile, файл .prof. Файлы пишутся в PROFILE_DIR,
+    имя возвращается в заголовке X-Profile-File. Без параметра middleware ничего не
+    делает, даже не загружает пользователя; ставится после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if "_profile" not in request.META.get("QUERY_STRING", "") and "HTTP_X_PROFILE" not in request.META:
+            return self.get_response(request)
+        mode = request.GET.get("_profile", request.META.get("HTTP_X_PROFILE")) or "sample"
+        if mode not in profiling.MODES or not request.user.is_staff:
+            return self.get_response(request)
+        response, name = profiling.profile(request, self.get_response, mode)
+        if name:
+            response["X-Profile-File"] = name
+        return response
+
+
+class CartCookieMiddleware:
+    """Удаляет cookie анонимной корзины после входа, через любую форму, включая админку.
+
+    Флаг drop_cart_cookie ставит обработчик user_logged_in, перенёсший корзину.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, "drop_cart_cookie", False):
+            response.delete_cookie(CART_COOKIE_NAME, samesite="Lax")
+        return response
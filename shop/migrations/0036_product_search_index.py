@@ -0,0 +1,82 @@
+# Generated by Django 4.2.22 on 2026-10-18 07:58
+
+from django.db import migrations
+
+# Копия SQL из shop.search на момент миграции: миграция не должна меняться вместе с модулем
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE shop_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS shop_product_search_vector_idx ON shop_product USING GIN (search_vector)",
+]
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS shop_product_search_vector_idx",
+    "ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+        name, description,
+        content='shop_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, description ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END
+    """,
+    "INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shop_product_fts_ad",
+    "DROP TRIGGER IF EXISTS shop_product_fts_au",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+def _execute(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            cursor.execute(sql)
+
+
+def install(apps, schema_editor):
+    _execute(schema_editor, {"postgresql": POSTGRES_INSTALL, "sqlite": SQLITE_INSTALL})
+
+
+def uninstall(apps, schema_editor):
+    _execute(schema_editor, {"postgresql": POSTGRES_UNINSTALL, "sqlite": SQLITE_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0035_remove_order__total_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
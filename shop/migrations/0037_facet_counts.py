@@ -0,0 +1,73 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:00
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# Копия верхних границ shop.models.PRICE_BUCKETS на момент миграции: миграция не должна
+# меняться вместе с моделью, пересчёт при новых границах — отдельной миграцией
+PRICE_BUCKET_BOUNDS = [Decimal("50"), Decimal("100"), Decimal("500"), Decimal("1000"), None]
+
+
+def fill_facet_counts(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    Category = apps.get_model("shop", "Category")
+    PriceBucket = apps.get_model("shop", "PriceBucket")
+    ProductCategory = Product.categories.through
+
+    lower = None
+    for index, upper in enumerate(PRICE_BUCKET_BOUNDS):
+        products = Product.objects.all()
+        if lower is not None:
+            products = products.filter(price__gte=lower)
+        if upper is not None:
+            products = products.filter(price__lt=upper)
+        products.update(price_bucket=index)
+        PriceBucket.objects.create(
+            bucket=index, product_count=products.filter(is_active=True).count()
+        )
+        lower = upper
+
+    category_counts = (
+        ProductCategory.objects.filter(category_id=models.OuterRef("pk"), product__is_active=True)
+        .order_by()
+        .values("category_id")
+        .annotate(total=models.Count("product_id"))
+        .values("total")
+    )
+    Category.objects.update(
+        product_count=Coalesce(models.Subquery(category_counts), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0036_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBucket',
+            fields=[
+                ('bucket', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Диапазон')),
+                ('product_count', models.PositiveIntegerField(default=0, verbose_name='Активных товаров')),
+            ],
+            options={
+                'verbose_name': 'ценовой диапазон',
+                'verbose_name_plural': 'Ценовые диапазоны',
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных товаров'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_bucket',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False, verbose_name='Ценовой диапазон'),
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
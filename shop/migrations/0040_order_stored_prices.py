@@ -0,0 +1,67 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:03
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def fill_prices(apps, schema_editor):
+    Order = apps.get_model("shop", "Order")
+    OrderItem = apps.get_model("shop", "OrderItem")
+    Product = apps.get_model("shop", "Product")
+
+    # Исторические цены не сохранялись (0027, 0035): берём текущую цену товара
+    OrderItem.objects.update(
+        unit_price=models.Subquery(
+            Product.objects.filter(pk=models.OuterRef("product_id")).values("price")[:1]
+        )
+    )
+
+    subtotals = dict(
+        OrderItem.objects.order_by()
+        .values_list("order_id")
+        .annotate(total=models.Sum(models.F("unit_price") * models.F("quantity")))
+    )
+    batch = []
+    for order in Order.objects.only("pk", "discount").iterator(chunk_size=500):
+        order.subtotal = subtotals.get(order.pk) or Decimal("0")
+        discount = Decimal(order.discount or 0)
+        order.discount_amount = (order.subtotal * discount / 100).quantize(Decimal("0.01"))
+        order.total_price = order.subtotal - order.discount_amount
+        batch.append(order)
+        if len(batch) >= 500:
+            Order.objects.bulk_update(batch, ["subtotal", "discount_amount", "total_price"])
+            batch = []
+    Order.objects.bulk_update(batch, ["subtotal", "discount_amount", "total_price"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0039_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Скидка, BYN'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Стоимость без скидки, BYN'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Итоговая цена, BYN'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Цена за единицу, BYN'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_prices, migrations.RunPython.noop),
+    ]
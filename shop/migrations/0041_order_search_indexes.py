@@ -0,0 +1,28 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:04
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0040_order_stored_prices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=15, validators=[django.core.validators.RegexValidator(message='Введите корректный номер телефона (например, +375 12 345 67 89)', regex='^[\\d+]\\d+$'), django.core.validators.MinLengthValidator(10)], verbose_name='Телефон'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='shop_order_email_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(django.db.models.functions.text.Upper('last_name'), name='shop_order_last_name_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, schema_editor):
+    CartItem = apps.get_model("shop", "CartItem")
+    duplicates = (
+        CartItem.objects.order_by()
+        .values("cart_id", "product_id")
+        .annotate(keep_id=models.Min("id"), total=models.Sum("quantity"), lines=models.Count("id"))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates.iterator():
+        CartItem.objects.filter(pk=row["keep_id"]).update(quantity=row["total"])
+        CartItem.objects.filter(cart_id=row["cart_id"], product_id=row["product_id"]).exclude(
+            pk=row["keep_id"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0042_order_checkout_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='shop_cartitem_unique_product'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:14
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    Comment = apps.get_model("shop", "Comment")
+    comments = Comment.objects.filter(product_id=models.OuterRef("pk")).order_by()
+    Product.objects.update(
+        comment_count=Coalesce(
+            models.Subquery(
+                comments.values("product_id").annotate(total=models.Count("id")).values("total")
+            ),
+            0,
+        ),
+        last_comment_at=models.Subquery(
+            comments.order_by("-created_at").values("created_at")[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0044_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний комментарий'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
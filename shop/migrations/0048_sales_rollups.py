@@ -0,0 +1,101 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_sales(apps, schema_editor):
+    # Пересчёт по историческим моделям, а не через shop.analytics: модуль будет меняться,
+    # а миграция должна работать со схемой на момент своего создания
+    Order = apps.get_model("shop", "Order")
+    OrderItem = apps.get_model("shop", "OrderItem")
+    DailySales = apps.get_model("shop", "DailySales")
+    CategorySales = apps.get_model("shop", "CategorySales")
+
+    days = {
+        row["day"]: DailySales(date=row["day"], order_count=row["orders"], revenue=row["revenue"] or 0)
+        for row in Order.objects.filter(status="confirmed")
+        .annotate(day=TruncDate("created_at"))
+        .order_by()
+        .values("day")
+        .annotate(orders=Count("id"), revenue=Sum("total_price"))
+    }
+    items = OrderItem.objects.filter(order__status="confirmed").annotate(
+        day=TruncDate("order__created_at")
+    )
+    for row in items.order_by().values("day").annotate(total=Sum("quantity")):
+        days[row["day"]].item_count = row["total"] or 0
+    DailySales.objects.bulk_create(days.values(), batch_size=1000)
+    CategorySales.objects.bulk_create(
+        [
+            CategorySales(
+                date=row["day"],
+                category_id=row["product__categories"],
+                item_count=row["items"] or 0,
+                revenue=row["revenue"] or 0,
+            )
+            for row in items.filter(product__categories__isnull=False)
+            .order_by()
+            .values("day", "product__categories")
+            .annotate(
+                items=Sum("quantity"),
+                revenue=Sum(F("unit_price") * F("quantity"), output_field=DecimalField()),
+            )
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0047_order_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='День')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка без скидки, BYN')),
+            ],
+            options={
+                'verbose_name': 'продажи категории за день',
+                'verbose_name_plural': 'Продажи по категориям',
+                'ordering': ['-date', 'category'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='День')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка, BYN')),
+            ],
+            options={
+                'verbose_name': 'продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='shop_order_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='categorysales',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.category', verbose_name='Категория'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysales',
+            constraint=models.UniqueConstraint(fields=('date', 'category'), name='shop_categorysales_unique_day'),
+        ),
+        migrations.RunPython(fill_sales, migrations.RunPython.noop),
+    ]
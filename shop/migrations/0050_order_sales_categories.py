@@ -0,0 +1,64 @@
+# Generated by Django 4.2.22 on 2026-10-18 08:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def attribute_confirmed_orders(apps, schema_editor):
+    # Уже подтверждённые заказы учтены в сводках по текущим категориям товаров
+    OrderItem = apps.get_model("shop", "OrderItem")
+    OrderSalesCategory = apps.get_model("shop", "OrderSalesCategory")
+    OrderSalesCategory.objects.bulk_create(
+        [
+            OrderSalesCategory(
+                order_id=row["order_id"],
+                category_id=row["product__categories"],
+                date=row["day"],
+                item_count=row["items"] or 0,
+                revenue=row["revenue"] or 0,
+            )
+            for row in OrderItem.objects.filter(
+                order__status="confirmed", product__categories__isnull=False
+            )
+            .annotate(day=TruncDate("order__created_at"))
+            .order_by()
+            .values("order_id", "day", "product__categories")
+            .annotate(
+                items=Sum("quantity"),
+                revenue=Sum(F("unit_price") * F("quantity"), output_field=DecimalField()),
+            )
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0049_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSalesCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='День')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка без скидки, BYN')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.category', verbose_name='Категория')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_categories', to='shop.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'продажи заказа по категории',
+                'verbose_name_plural': 'Продажи заказов по категориям',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ordersalescategory',
+            constraint=models.UniqueConstraint(fields=('order', 'category'), name='shop_ordersalescategory_unique'),
+        ),
+        migrations.RunPython(attribute_confirmed_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.22 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import shop.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0050_order_sales_categories'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='address_street',
+            field=models.CharField(max_length=100, validators=[shop.models.validate_str], verbose_name='Улица'),
+        ),
+    ]
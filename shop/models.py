@@ -1,5 +1,9 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator, MinLengthValidator, MaxLengthValidator, RegexValidator
@@ -14,6 +18,26 @@ def validate_str(value: str):
     if not value.isalpha():
         raise ValidationError("Допустимы только буквенные значения и дефис (-)")
 
+
+# Ценовые диапазоны фильтра: (верхняя граница не включительно, подпись)
+PRICE_BUCKETS = [
+    (Decimal("50"), "до 50 BYN"),
+    (Decimal("100"), "50 – 100 BYN"),
+    (Decimal("500"), "100 – 500 BYN"),
+    (Decimal("1000"), "500 – 1000 BYN"),
+    (None, "от 1000 BYN"),
+]
+
+
+RATING_CHOICES = [(value, "★" * value) for value in range(1, 6)]
+
+
+def get_price_bucket(price):
+    price = Decimal(str(price))
+    for index, (upper, _) in enumerate(PRICE_BUCKETS):
+        if upper is None or price < upper:
+            return index
+
 class Category(models.Model):
     name = models.CharField(max_length=50, verbose_name="Название")
     slug = models.SlugField(
@@ -22,6 +46,10 @@ class Category(models.Model):
         verbose_name="Уникальный URL",
         help_text="Короткая метка для контента, содержащая только буквы, цифры, подчеркивания (_) или дефисы (-)",
     )
+    product_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Активных товаров"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -31,6 +59,17 @@ class Category(models.Model):
         verbose_name_plural = "Категории"
 
 
+class ProductQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def for_listing(self):
+        # Категории всех товаров страницы подгружаются одним запросом, а не по запросу на карточку
+        return self.prefetch_related(
+            models.Prefetch("categories", queryset=Category.objects.only("name"))
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название")
     price = models.DecimalField(
@@ -50,7 +89,42 @@ class Product(models.Model):
     image = models.ImageField(
         upload_to="images/products", verbose_name="Изображение", null=True, blank=True
     )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True, verbose_name="Товар активен")
+    price_bucket = models.PositiveSmallIntegerField(
+        default=0, editable=False, db_index=True, verbose_name="Ценовой диапазон"
+    )
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Комментариев"
+    )
+    last_comment_at = models.DateTimeField(
+        null=True, blank=True, editable=False, verbose_name="Последний комментарий"
+    )
+    # Оценки из комментариев: количество, сумма и гистограмма; среднее хранится для сортировки
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок")
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False, verbose_name="Средняя оценка")
+
+    objects = ProductQuerySet.as_manager()
+
+    # Счётчики меняются только атомарными UPDATE из сигналов; save() их не перезаписывает
+    COUNTER_FIELDS = (
+        "comment_count",
+        "last_comment_at",
+        "rating_count",
+        "rating_sum",
+        "rating_1",
+        "rating_2",
+        "rating_3",
+        "rating_4",
+        "rating_5",
+        "rating_avg",
+    )
 
     @property
     def cats(self):
@@ -64,13 +138,42 @@ class Product(models.Model):
     class Meta:
         verbose_name = "товар"
         verbose_name_plural = "Товары"
+        indexes = [
+            # Сортировка каталога по рейтингу (keyset по rating_avg, id)
+            models.Index(fields=["-rating_avg", "-id"], name="shop_product_rating_idx"),
+            # Главная и категории: активные товары, новые первыми. Неактивные в индекс не входят
+            models.Index(
+                fields=["-created_at", "-id"],
+                name="shop_product_active_new_idx",
+                condition=models.Q(is_active=True),
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        self.price_bucket = get_price_bucket(self.price)
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
 
+class PriceBucket(models.Model):
+    bucket = models.PositiveSmallIntegerField(primary_key=True, verbose_name="Диапазон")
+    product_count = models.PositiveIntegerField(default=0, verbose_name="Активных товаров")
+
+    class Meta:
+        verbose_name = "ценовой диапазон"
+        verbose_name_plural = "Ценовые диапазоны"
+
+    def __str__(self):
+        return PRICE_BUCKETS[self.bucket][1]
+
+
 class Comment(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, verbose_name="Пользователь"
@@ -79,6 +182,13 @@ class Comment(models.Model):
         Product, on_delete=models.CASCADE, related_name="comments", verbose_name="Товар"
     )
     text = models.TextField(verbose_name="Текст")
+    rating = models.PositiveSmallIntegerField(
+        choices=RATING_CHOICES,
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1), MaxValueValidator(5)],
+        verbose_name="Оценка",
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
     image = models.ImageField(
         upload_to="images/comments",
@@ -86,6 +196,7 @@ class Comment(models.Model):
         null=True,
         blank=True,
     )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Комментарий {self.user} на товар {self.product} создан {self.created_at.strftime('%d-%m-%Y в %H:%M')}"
@@ -93,7 +204,10 @@ class Comment(models.Model):
     class Meta:
         verbose_name = "комментарий"
         verbose_name_plural = "Комментарии"
-        
+        indexes = [
+            # Страницы комментариев товара (keyset по created_at, id)
+            models.Index(fields=["product", "-created_at", "-id"], name="shop_comment_product_new_idx"),
+        ]
 
 
 class Cart(models.Model):
@@ -132,6 +246,9 @@ class CartItem(models.Model):
         ordering = ['-id']
         verbose_name = "предмет корзины"
         verbose_name_plural = "Предметы корзины"
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="shop_cartitem_unique_product"),
+        ]
 
     @property
     def price(self):
@@ -142,7 +259,7 @@ class CartItem(models.Model):
         return self.product.price
 
     def __str__(self):
-        return f"Предмет #{self.pk} ({self.product.name}) добавлен в корзину #{self.cart.pk} -- количество: {self.quantity} шт. --  цена: {self.price} BYN"
+        return f"Предмет #{self.pk} ({self.product.name}) добавлен в корзину #{self.cart_id} -- количество: {self.quantity} шт. --  цена: {self.price} BYN"
 
 
 class Order(models.Model):
@@ -158,7 +275,7 @@ class Order(models.Model):
     last_name = models.CharField(verbose_name="Фамилия", max_length=50)
     email = models.EmailField(max_length=254)
     phone = models.CharField(
-        verbose_name="Телефон", max_length=15, validators=[regex_phone_validator, MinLengthValidator(10)]
+        verbose_name="Телефон", max_length=15, db_index=True, validators=[regex_phone_validator, MinLengthValidator(10)]
     )
     address_street = models.CharField(verbose_name="Улица", max_length=100, validators=[validate_str])
     address_building = models.PositiveIntegerField(verbose_name="Номер дома", null=True, blank=True, validators=[MaxValueValidator(300)])
@@ -171,29 +288,63 @@ class Order(models.Model):
     created_at = models.DateTimeField(
         auto_now=False, auto_now_add=True, verbose_name="Создано"
     )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
+    # Растёт при каждом save() (в БД, через F()): внешние системы по нему отличают новую версию заказа
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
+    subtotal = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, verbose_name="Стоимость без скидки, BYN"
+    )
+    discount_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, verbose_name="Скидка, BYN"
+    )
+    total_price = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, verbose_name="Итоговая цена, BYN"
+    )
+    checkout_token = models.UUIDField(
+        null=True, blank=True, unique=True, editable=False, verbose_name="Токен оформления"
+    )
 
     def __str__(self):
         return f"Заказ #{self.pk} -- пользователь {self.user} -- создан {self.created_at.strftime('%d-%m-%Y в %H:%M')}"
 
-    @property
-    def price(self):
-        return sum(item.price for item in self.items.all())
+    def apply_discount(self):
+        discount = Decimal(self.discount or 0)
+        self.discount_amount = (self.subtotal * discount / 100).quantize(Decimal("0.01"))
+        self.total_price = self.subtotal - self.discount_amount
 
-    @property
-    def discount_amount(self):
-        return  self.price / 100 * self.discount
+    def refresh_subtotal(self):
+        # Только для правок позиций задним числом: при оформлении сумма считается по корзине
+        subtotal = self.items.aggregate(
+            total=models.Sum(models.F("unit_price") * models.F("quantity"))
+        )["total"]
+        self.subtotal = subtotal or Decimal("0")
 
-    @property
-    # @admin.display(description='Итоговая цена')
-    def total_price(self):
-        if self.discount is None:
-            return self.price
-        else:
-            return self.price - (self.price / 100 * self.discount)
+    def save(self, *args, **kwargs):
+        self.apply_discount()
+        bump_version = not self._state.adding
+        if bump_version:
+            # Прибавляет СУБД: копия заказа, прочитанная до чужого save(), не откатит версию
+            self.version = models.F("version") + 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+        super().save(*args, **kwargs)
+        if bump_version:
+            self.refresh_from_db(fields=["version"])
 
     class Meta:
         verbose_name = "заказ"
         verbose_name_plural = "Заказы"
+        indexes = [
+            # Поиск в админке идёт по iexact, то есть по UPPER(...)
+            models.Index(Upper("email"), name="shop_order_email_upper_idx"),
+            models.Index(Upper("last_name"), name="shop_order_last_name_upper_idx"),
+            # Лента изменений читает заказы по (updated_at, id)
+            models.Index(fields=["updated_at", "id"], name="shop_order_changes_idx"),
+            # Пересчёт сводок продаж за день или период
+            models.Index(fields=["created_at"], name="shop_order_created_idx"),
+            # Заказы пользователя в профиле, новые первыми
+            models.Index(fields=["user", "-created_at"], name="shop_order_user_created_idx"),
+        ]
 
 
 class OrderItem(models.Model):
@@ -202,15 +353,118 @@ class OrderItem(models.Model):
         Product, verbose_name=("Товар"), on_delete=models.CASCADE
     )
     quantity = models.PositiveIntegerField(verbose_name="Количество, шт.")
-   
+    unit_price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name="Цена за единицу, BYN"
+    )
+
     @property
     def price(self):
-        return self.product.price * self.quantity
+        return self.unit_price * self.quantity
 
     def __str__(self):
-        return f"Предмет #{self.pk} ({self.product.name}) добавлен в  заказ #{self.order.pk} -- количество: {self.quantity} шт. --  цена: {self.price} BYN"
+        return f"Предмет #{self.pk} ({self.product.name}) добавлен в  заказ #{self.order_id} -- количество: {self.quantity} шт. --  цена: {self.price} BYN"
 
     class Meta:
         verbose_name = "предмет заказа"
         verbose_name_plural = "Предметы заказов"
 
+
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ("queued", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Выполнено"),
+        ("failed", "Ошибка"),
+    ]
+    name = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    priority = models.SmallIntegerField(default=0, verbose_name="Приоритет")
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default="queued", verbose_name="Статус"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name="Максимум попыток")
+    run_at = models.DateTimeField(default=timezone.now, verbose_name="Запустить после")
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="Воркер")
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="Заблокирована до")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    class Meta:
+        verbose_name = "фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            models.Index(fields=["status", "-priority", "run_at"], name="shop_job_claim_idx"),
+        ]
+
+    def __str__(self):
+        return f"Задача #{self.pk} {self.name} -- {self.get_status_display()}"
+
+
+class DailySales(models.Model):
+    """Сводка подтверждённых заказов за день; ведётся сигналами, см. shop.analytics."""
+
+    date = models.DateField(unique=True, verbose_name="День")
+    order_count = models.PositiveIntegerField(default=0, verbose_name="Заказов")
+    item_count = models.PositiveIntegerField(default=0, verbose_name="Товаров, шт.")
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, verbose_name="Выручка, BYN"
+    )
+
+    class Meta:
+        verbose_name = "продажи за день"
+        verbose_name_plural = "Продажи по дням"
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"Продажи за {self.date}"
+
+
+class CategorySales(models.Model):
+    date = models.DateField(verbose_name="День")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    item_count = models.PositiveIntegerField(default=0, verbose_name="Товаров, шт.")
+    # Сумма позиций без скидки заказа: скидка не делится между категориями
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, verbose_name="Выручка без скидки, BYN"
+    )
+
+    class Meta:
+        verbose_name = "продажи категории за день"
+        verbose_name_plural = "Продажи по категориям"
+        ordering = ["-date", "category"]
+        constraints = [
+            models.UniqueConstraint(fields=["date", "category"], name="shop_categorysales_unique_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} за {self.date}"
+
+
+class OrderSalesCategory(models.Model):
+    """Вклад подтверждённого заказа в продажи категории, как он был учтён в CategorySales.
+
+    Запоминается при подтверждении: отмена вычитает ровно прибавленное, даже если
+    товар потом перенесли в другую категорию.
+    """
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="sales_categories", verbose_name="Заказ"
+    )
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    date = models.DateField(verbose_name="День")
+    item_count = models.PositiveIntegerField(default=0, verbose_name="Товаров, шт.")
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, verbose_name="Выручка без скидки, BYN"
+    )
+
+    class Meta:
+        verbose_name = "продажи заказа по категории"
+        verbose_name_plural = "Продажи заказов по категориям"
+        constraints = [
+            models.UniqueConstraint(fields=["order", "category"], name="shop_ordersalescategory_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}: {self.category_id}"
@@ -0,0 +1,110 @@
+import logging
+import re
+import sys
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .timing import SKIP_FILES, call_site, wrap_connections
+
+logger = logging.getLogger("shop.nplusone")
+
+# Сколько одинаковых запросов за один HTTP-запрос считается N+1
+THRESHOLD = getattr(settings, "NPLUSONE_THRESHOLD", 5)
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+SKIP_FILES.add(__file__)
+
+
+class NPlusOneDetected(AssertionError):
+    """AssertionError, чтобы в тестах срабатывание было провалом, а не ошибкой."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(format_problems(problems))
+
+
+def fingerprint(sql):
+    """SQL без значений: запросы одной формы с разными id дают один отпечаток."""
+    return _LITERAL.sub("?", _IN_LIST.sub("IN (...)", sql))
+
+
+def template_site(skip=2):
+    """Строка шаблона, при отрисовке которой выполняется запрос, или None."""
+    frame = sys._getframe(skip)
+    while frame is not None:
+        if frame.f_code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            origin, token = getattr(node, "origin", None), getattr(node, "token", None)
+            if origin is not None and token is not None:
+                return f"{origin.template_name or origin.name}:{token.lineno}"
+        frame = frame.f_back
+    return None
+
+
+class Detector:
+    """Обёртка для connection.execute_wrapper, считающая повторы одинаковых SELECT.
+
+    Повторы записи (UPDATE счётчиков, точки сохранения) — не N+1 при чтении и не считаются.
+    Место вызова ищется только со второго повтора: первый запрос — обычная загрузка,
+    а обход стека на каждом запросе стоил бы заметно дороже.
+    """
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.samples = {}
+        self.sites = defaultdict(Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == "SELECT":
+            key = fingerprint(sql)
+            self.counts[key] += 1
+            if self.counts[key] == 1:
+                self.samples[key] = sql
+            else:
+                self.sites[key][(call_site(), template_site())] += 1
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        return [
+            {
+                "count": count,
+                "sql": self.samples[key],
+                "sites": [
+                    {"python": python, "template": template, "count": site_count}
+                    for (python, template), site_count in self.sites[key].most_common(3)
+                ],
+            }
+            for key, count in self.counts.most_common()
+            if count >= self.threshold
+        ]
+
+
+def format_problems(problems):
+    lines = []
+    for problem in problems:
+        lines.append(f"N+1: {problem['count']} раз {problem['sql'][:200]}")
+        for site in problem["sites"]:
+            where = " / ".join(filter(None, [site["template"], site["python"]])) or "?"
+            lines.append(f"    {where} ({site['count']})")
+    return "\n".join(lines)
+
+
+@contextmanager
+def detect(threshold=THRESHOLD, raise_errors=True):
+    """Отслеживает N+1 в блоке; при срабатывании бросает NPlusOneDetected или пишет в лог.
+
+    with detect():
+        self.client.get(url)
+    """
+    with wrap_connections(Detector(threshold)) as detector:
+        yield detector
+    problems = detector.problems()
+    if problems:
+        if raise_errors:
+            raise NPlusOneDetected(problems)
+        logger.warning(format_problems(problems), extra={"nplusone": problems})
@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PER_PAGE = getattr(settings, "PRODUCTS_PER_PAGE", 20)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump_value(value):
+    # DjangoJSONEncoder обрезает микросекунды, а для keyset-курсора нужно точное значение
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, direction="next"):
+    payload = json.dumps(
+        {"d": direction, "v": [_dump_value(value) for value in values]},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values = payload["d"], payload["v"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+def _field_name(order):
+    return order.lstrip("-")
+
+
+def _reverse_order(order):
+    return order[1:] if order.startswith("-") else f"-{order}"
+
+
+def _seek_filter(ordering, values):
+    # Лексикографическое сравнение (a, b) > (x, y) как OR из условий по префиксам
+    condition = Q()
+    for i, order in enumerate(ordering):
+        lookup = "lt" if order.startswith("-") else "gt"
+        prefix = {_field_name(o): v for o, v in zip(ordering[:i], values)}
+        prefix[f"{_field_name(order)}__{lookup}"] = values[i]
+        condition |= Q(**prefix)
+    return condition
+
+
+class KeysetPage:
+    def __init__(self, items, ordering, has_next, has_prev):
+        self.object_list = items
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+    def _cursor(self, item, direction):
+        values = [getattr(item, _field_name(order)) for order in self.ordering]
+        return encode_cursor(values, direction)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1], "next")
+        return None
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.object_list:
+            return self._cursor(self.object_list[0], "prev")
+        return None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=PER_PAGE):
+    """Страница queryset по курсору; стоимость не зависит от номера страницы.
+
+    ordering должен однозначно упорядочивать строки, поэтому последним
+    полем обычно идёт первичный ключ.
+    """
+    if not cursor:
+        items = list(queryset.order_by(*ordering)[: per_page + 1])
+        return KeysetPage(items[:per_page], ordering, len(items) > per_page, False)
+
+    direction, values = decode_cursor(cursor)
+    if len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+
+    seek_ordering = ordering
+    if direction == "prev":
+        seek_ordering = tuple(_reverse_order(order) for order in ordering)
+    try:
+        queryset = queryset.filter(_seek_filter(seek_ordering, values))
+    except (ValidationError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    items = list(queryset.order_by(*seek_ordering)[: per_page + 1])
+
+    if direction == "next":
+        return KeysetPage(items[:per_page], ordering, len(items) > per_page, True)
+
+    has_prev = len(items) > per_page
+    items = items[:per_page]
+    items.reverse()
+    return KeysetPage(items, ordering, True, has_prev)
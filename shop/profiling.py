@@ -0,0 +1,120 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_DIR = getattr(settings, "PROFILE_DIR", os.path.join(settings.BASE_DIR, "profiles"))
+# Сколько последних профилей хранить; старые удаляются после каждой записи
+PROFILE_KEEP = getattr(settings, "PROFILE_KEEP", 100)
+# Интервал сэмплирования, секунды
+SAMPLE_INTERVAL = getattr(settings, "PROFILE_SAMPLE_INTERVAL", 0.001)
+
+MODES = ("sample", "cprofile")
+_PROJECT_DIR = str(settings.BASE_DIR) + os.sep
+# Одновременно профилируется один запрос: профилировщик сам нагружает сервер
+_busy = threading.Lock()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_PROJECT_DIR):
+        filename = filename[len(_PROJECT_DIR):]
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+    # ";" разделяет кадры в формате collapsed stacks
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class Sampler:
+    """Сэмплирующий профилировщик потока: раз в interval снимает его стек из фонового потока.
+
+    Стек обрезается по кадру root, чтобы в профиль не попадали сервер и middleware.
+    """
+
+    def __init__(self, root, interval=SAMPLE_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and frame is not self.root:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self):
+        # Сэмплер получает GIL не чаще интервала переключения потоков (по умолчанию 5 мс).
+        # На время профиля он уменьшается; профилируется всегда один запрос, см. _busy
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def collapsed(self):
+        """Формат collapsed stacks: открывается в speedscope и flamegraph.pl."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _cleanup():
+    files = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in files[PROFILE_KEEP:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def _filename(request, extension):
+    path = re.sub(r"[^\w-]+", "_", request.path).strip("_") or "index"
+    return f"{timezone.now():%Y%m%d-%H%M%S-%f}-{request.method}-{path[:80]}.{extension}"
+
+
+def profile(request, get_response, mode):
+    """Выполняет запрос под профилировщиком; возвращает ответ и имя файла профиля.
+
+    Если другой запрос уже профилируется, этот выполняется как обычно, без файла.
+    """
+    if not _busy.acquire(blocking=False):
+        return get_response(request), None
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        started = time.perf_counter()
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            response = profiler.runcall(get_response, request)
+            name = _filename(request, "prof")
+            profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        else:
+            with Sampler(sys._getframe()) as sampler:
+                response = get_response(request)
+            name = _filename(request, "collapsed")
+            with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+                f.write(sampler.collapsed())
+        response["X-Profile-Time"] = f"{(time.perf_counter() - started) * 1000:.1f}ms"
+        _cleanup()
+        return response, name
+    finally:
+        _busy.release()
@@ -0,0 +1,77 @@
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import RATING_CHOICES, Comment, Product
+
+RATINGS = [value for value, _ in RATING_CHOICES]
+
+
+def rating_changes(added=None, removed=None):
+    """Поля для Product.objects.update(): замена оценки removed на added одним UPDATE.
+
+    Все выражения читают значения строки до обновления, поэтому среднее
+    считается по новым сумме и количеству без повторного запроса.
+    """
+    if added == removed:
+        return {}
+    count_delta = (added is not None) - (removed is not None)
+    sum_delta = (added or 0) - (removed or 0)
+    count = F("rating_count") + count_delta
+    changes = {
+        "rating_count": count,
+        "rating_sum": F("rating_sum") + sum_delta,
+        "rating_avg": Case(
+            When(
+                rating_count__gt=-count_delta,
+                then=Cast(F("rating_sum") + sum_delta, FloatField()) / count,
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+    if added is not None:
+        changes[f"rating_{added}"] = F(f"rating_{added}") + 1
+    if removed is not None:
+        changes[f"rating_{removed}"] = F(f"rating_{removed}") - 1
+    return changes
+
+
+def histogram(product):
+    total = product.rating_count
+    return [
+        {
+            "rating": rating,
+            "count": getattr(product, f"rating_{rating}"),
+            "percent": round(getattr(product, f"rating_{rating}") * 100 / total) if total else 0,
+        }
+        for rating in reversed(RATINGS)
+    ]
+
+
+def rebuild_ratings():
+    """Полный пересчёт оценок, например после правок комментариев в обход сигналов."""
+    rated = Comment.objects.filter(product_id=OuterRef("pk"), rating__isnull=False).order_by()
+
+    def aggregate(expression, **filters):
+        return Coalesce(
+            Subquery(
+                rated.filter(**filters)
+                .values("product_id")
+                .annotate(value=expression)
+                .values("value")
+            ),
+            0,
+        )
+
+    Product.objects.update(
+        rating_count=aggregate(Count("id")),
+        rating_sum=aggregate(Sum("rating")),
+        **{f"rating_{rating}": aggregate(Count("id"), rating=rating) for rating in RATINGS},
+    )
+    Product.objects.update(
+        rating_avg=Case(
+            When(rating_count__gt=0, then=Cast("rating_sum", FloatField()) / F("rating_count")),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
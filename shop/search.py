@@ -0,0 +1,205 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+from .pagination import PER_PAGE
+
+# Вес названия выше веса описания: A/B в tsvector, коэффициенты bm25 в FTS5
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE shop_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS shop_product_search_vector_idx ON shop_product USING GIN (search_vector)",
+]
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS shop_product_search_vector_idx",
+    "ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+        name, description,
+        content='shop_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+SQLITE_TRIGGERS = {
+    "shop_product_fts_ai": """
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product BEGIN
+            INSERT INTO shop_product_fts(rowid, name, description)
+            VALUES (new.id, new.name, coalesce(new.description, ''));
+        END
+    """,
+    "shop_product_fts_ad": """
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+            INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+        END
+    """,
+    "shop_product_fts_au": """
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, description ON shop_product BEGIN
+            INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+            INSERT INTO shop_product_fts(rowid, name, description)
+            VALUES (new.id, new.name, coalesce(new.description, ''));
+        END
+    """,
+}
+SQLITE_UNINSTALL = [
+    *(f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS),
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+# Окончания для упрощённого стемминга на SQLite: в FTS5 нет русского стеммера,
+# поэтому основа слова ищется префиксным запросом
+RUSSIAN_ENDINGS = sorted(
+    [
+        "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ого", "его", "ому",
+        "ему", "ыми", "ими", "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее",
+        "ые", "ие", "ую", "юю", "ых", "их", "ым", "им", "ою", "ею", "ом", "ем",
+        "ам", "ям", "ах", "ях", "ов", "ев",
+        "ы", "и", "а", "я", "о", "е", "у", "ю", "ь", "й",
+    ],
+    key=len,
+    reverse=True,
+)
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def install_search_index(conn):
+    """Создаёт индекс поиска для текущей БД; повторный вызов безопасен."""
+    with conn.cursor() as cursor:
+        if conn.vendor == "postgresql":
+            for sql in POSTGRES_INSTALL:
+                cursor.execute(sql)
+        elif conn.vendor == "sqlite":
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+                % ", ".join("'%s'" % name for name in SQLITE_TRIGGERS)
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            cursor.execute(SQLITE_TABLE)
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            # SQLite пересоздаёт таблицу при ALTER и теряет триггеры, индекс надо догнать
+            if existing != set(SQLITE_TRIGGERS):
+                cursor.execute("INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')")
+
+
+def uninstall_search_index(conn):
+    statements = {"postgresql": POSTGRES_UNINSTALL, "sqlite": SQLITE_UNINSTALL}
+    with conn.cursor() as cursor:
+        for sql in statements.get(conn.vendor, []):
+            cursor.execute(sql)
+
+
+def ensure_search_index(sender, using, **kwargs):
+    conn = connections[using]
+    if conn.vendor == "sqlite" and "shop_product" in conn.introspection.table_names():
+        install_search_index(conn)
+
+
+def stem(word):
+    word = word.lower()
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def _fts5_query(query):
+    words = WORD_RE.findall(query)
+    return " ".join('"%s"*' % stem(word) for word in words)
+
+
+def _search_sql(query, active_only=False, ranked=False):
+    """SQL-подзапрос id подходящих товаров и его параметры."""
+    if connection.vendor == "postgresql":
+        sql = (
+            "SELECT id FROM shop_product, websearch_to_tsquery('russian', %s) query "
+            "WHERE search_vector @@ query"
+        )
+        if active_only:
+            sql += " AND is_active"
+        if ranked:
+            sql += " ORDER BY ts_rank(search_vector, query) DESC, id DESC"
+        return sql, [query]
+    if connection.vendor == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return None
+        sql = "SELECT shop_product_fts.rowid FROM shop_product_fts"
+        if active_only:
+            sql += " JOIN shop_product ON shop_product.id = shop_product_fts.rowid"
+        sql += " WHERE shop_product_fts MATCH %s"
+        if active_only:
+            sql += " AND shop_product.is_active"
+        if ranked:
+            sql += (
+                f" ORDER BY bm25(shop_product_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}),"
+                " shop_product_fts.rowid DESC"
+            )
+        return sql, [match]
+    return None
+
+
+def filter_products(queryset, query):
+    """Оставляет в queryset только товары, подходящие под запрос (без ранжирования)."""
+    search = _search_sql(query)
+    if search is None:
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+    sql, params = search
+    return queryset.filter(id__in=RawSQL(sql, params))
+
+
+class SearchPage:
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.has_next = has_next
+        self.has_prev = number > 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def prev_page_number(self):
+        return self.number - 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def search_products(query, page=1, per_page=PER_PAGE):
+    """Активные товары по запросу, по убыванию релевантности, страница page."""
+    search = _search_sql(query, active_only=True, ranked=True)
+    offset = (page - 1) * per_page
+    if search is None:
+        products = filter_products(Product.objects.active(), query).order_by("-id")
+        ids = list(products.values_list("id", flat=True)[offset : offset + per_page + 1])
+    else:
+        sql, params = search
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} LIMIT %s OFFSET %s", [*params, per_page + 1, offset])
+            ids = [row[0] for row in cursor.fetchall()]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    products = Product.objects.for_listing().in_bulk(ids)
+    return SearchPage([products[pk] for pk in ids if pk in products], page, has_next)
@@ -0,0 +1,94 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Sum
+
+from .models import Cart, CartItem, Order, OrderItem
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def checkout(cart, order_data, token):
+    """Создаёт заказ из корзины за фиксированное число запросов.
+
+    Повтор с тем же token возвращает уже созданный заказ.
+    """
+    try:
+        with transaction.atomic():
+            # Блокировка строки корзины сериализует параллельные оформления одной корзины
+            Cart.objects.select_for_update().filter(pk=cart.pk).exists()
+            existing = Order.objects.filter(checkout_token=token, user=cart.user_id).first()
+            if existing is not None:
+                return existing
+
+            items = list(CartItem.objects.filter(cart=cart).select_related("product"))
+            if not items:
+                raise EmptyCart
+
+            order = Order(user_id=cart.user_id, checkout_token=token, **order_data)
+            order.subtotal = sum(item.price for item in items)
+            order.save()
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=order,
+                        product=item.product,
+                        quantity=item.quantity,
+                        unit_price=item.product.price,
+                    )
+                    for item in items
+                ]
+            )
+            # Удаляем только оформленные позиции: добавленные за это время останутся в корзине
+            CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+            return order
+    except IntegrityError:
+        # Параллельный запрос с тем же токеном успел создать заказ первым
+        existing = Order.objects.filter(checkout_token=token, user=cart.user_id).first()
+        if existing is None:
+            raise
+        return existing
+
+
+def add_cart_item(cart, product, amount=1):
+    """Увеличивает количество одним UPDATE; позиция создаётся, только если её ещё нет."""
+    lines = CartItem.objects.filter(cart=cart, product=product)
+    if lines.update(quantity=F("quantity") + amount):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product=product, quantity=amount)
+    except IntegrityError:
+        # Позицию успел создать параллельный запрос: уникальность (cart, product)
+        lines.update(quantity=F("quantity") + amount)
+
+
+def increase_cart_item(cart, slug, amount=1):
+    return CartItem.objects.filter(cart=cart, product__slug=slug).update(
+        quantity=F("quantity") + amount
+    )
+
+
+def decrease_cart_item(cart, slug, amount=1):
+    """Уменьшает количество; позиция, где осталось бы меньше одной штуки, удаляется."""
+    lines = CartItem.objects.filter(cart=cart, product__slug=slug)
+    if lines.filter(quantity__gt=amount).update(quantity=F("quantity") - amount):
+        return True
+    lines.delete()
+    return False
+
+
+def remove_cart_item(cart, slug):
+    CartItem.objects.filter(cart=cart, product__slug=slug).delete()
+
+
+def cart_total(cart):
+    total = CartItem.objects.filter(cart=cart).aggregate(
+        total=Sum(
+            F("quantity") * F("product__price"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    )["total"]
+    return (total or Decimal("0")).quantize(Decimal("0.01"))
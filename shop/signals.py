@@ -0,0 +1,237 @@
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, facets
+from .images import variants_outdated
+from .jobs import enqueue
+from . import analytics
+from .cart import COOKIE_NAME as CART_COOKIE_NAME, merge_session_cart
+from .models import Category, Comment, Order, Product
+from .ratings import rating_changes
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = (
+            Product.objects.filter(pk=instance.pk).values("is_active", "price_bucket").first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = instance._previous_state or {"is_active": False, "price_bucket": None}
+    if previous["is_active"] and not instance.is_active:
+        facets.change_category_counts(list(instance.categories.values_list("id", flat=True)), -1)
+        facets.change_bucket_count(previous["price_bucket"], -1)
+    elif instance.is_active and not previous["is_active"]:
+        if not created:
+            facets.change_category_counts(list(instance.categories.values_list("id", flat=True)), 1)
+        facets.change_bucket_count(instance.price_bucket, 1)
+    elif instance.is_active and previous["price_bucket"] != instance.price_bucket:
+        facets.change_bucket_count(previous["price_bucket"], -1)
+        facets.change_bucket_count(instance.price_bucket, 1)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def update_facets_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # category.product_set.add(...): instance — категория, pk_set — товары
+        products = Product.objects.active()
+        if action == "post_add":
+            facets.change_category_counts([instance.pk], products.filter(pk__in=pk_set).count())
+        elif action == "pre_remove":
+            instance._removed_products = products.filter(pk__in=pk_set, categories=instance).count()
+        elif action == "pre_clear":
+            instance._removed_products = products.filter(categories=instance).count()
+        elif action in ("post_remove", "post_clear"):
+            facets.change_category_counts([instance.pk], -instance._removed_products)
+        return
+
+    if not instance.is_active:
+        return
+    if action == "post_add":
+        facets.change_category_counts(pk_set, 1)
+    elif action == "pre_remove":
+        instance._removed_categories = list(
+            instance.categories.filter(pk__in=pk_set).values_list("id", flat=True)
+        )
+    elif action == "pre_clear":
+        instance._removed_categories = list(instance.categories.values_list("id", flat=True))
+    elif action in ("post_remove", "post_clear"):
+        facets.change_category_counts(instance._removed_categories, -1)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_deleted_product_categories(sender, instance, **kwargs):
+    instance._deleted_categories = []
+    if instance.is_active:
+        instance._deleted_categories = list(instance.categories.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_delete(sender, instance, **kwargs):
+    if instance.is_active:
+        facets.change_category_counts(instance._deleted_categories, -1)
+        facets.change_bucket_count(instance.price_bucket, -1)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Comment.objects.filter(pk=instance.pk).values_list("rating", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = rating_changes(instance.rating, instance._previous_rating)
+    if created:
+        created_at = Value(instance.created_at)
+        changes.update(
+            comment_count=F("comment_count") + 1,
+            last_comment_at=Greatest(Coalesce("last_comment_at", created_at), created_at),
+        )
+    if changes:
+        Product.objects.filter(pk=instance.product_id).update(**changes)
+    if instance.rating != instance._previous_rating:
+        # Рейтинг виден в карточках и влияет на сортировку каталога
+        cache.bump("catalog")
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(
+        comment_count=F("comment_count") - 1,
+        last_comment_at=Subquery(
+            Comment.objects.filter(product_id=OuterRef("pk"))
+            .order_by("-created_at")
+            .values("created_at")[:1]
+        ),
+        **rating_changes(removed=instance.rating),
+    )
+    if instance.rating is not None:
+        cache.bump("catalog")
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_state(sender, instance, using=None, **kwargs):
+    instance._previous_state = None
+    if instance.pk:
+        orders = Order.objects.using(using).filter(pk=instance.pk)
+        # В транзакции строка блокируется до коммита: параллельное сохранение дождётся его
+        # и прочитает уже новый статус, а не прибавит заказ к сводкам второй раз
+        if transaction.get_connection(using).in_atomic_block:
+            orders = orders.select_for_update()
+        instance._previous_state = orders.values("status", "total_price").first()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = instance._previous_state or {"status": None, "total_price": None}
+    was_counted = previous["status"] == analytics.COUNTED_STATUS
+    is_counted = instance.status == analytics.COUNTED_STATUS
+    if is_counted and not was_counted:
+        analytics.apply_order(instance, 1)
+    elif was_counted and not is_counted:
+        analytics.apply_order(instance, -1)
+    elif is_counted and previous["total_price"] != instance.total_price:
+        # Позиции подтверждённого заказа поправили в админке: прежний состав уже неизвестен
+        analytics.attribute_order(instance)
+        analytics.rebuild_day(timezone.localdate(instance.created_at))
+
+
+@receiver(pre_delete, sender=Order)
+def update_sales_on_delete(sender, instance, **kwargs):
+    # pre_delete: позиции заказа ещё не удалены каскадом
+    if instance.status == analytics.COUNTED_STATUS:
+        analytics.apply_order(instance, -1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Comment)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw and variants_outdated(instance):
+        enqueue(
+            "images.build_variants",
+            {"model": instance._meta.label_lower, "pk": instance.pk},
+        )
+
+
+def touch_products(product_ids):
+    # Карточки товаров кэшируются по updated_at, поэтому меняем его и без save()
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_page_cache(sender, instance, **kwargs):
+    if sender is Comment:
+        cache.bump(f"comments:{instance.product_id}")
+    else:
+        cache.bump("catalog")
+
+
+@receiver(post_save, sender=Category)
+def touch_category_products(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        touch_products(list(instance.product_set.values_list("id", flat=True)))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._cached_products = list(instance.product_set.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def touch_deleted_category_products(sender, instance, **kwargs):
+    touch_products(instance._cached_products)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_page_cache_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        instance._cached_products = list(instance.product_set.values_list("id", flat=True))
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == "post_clear":
+        product_ids = instance._cached_products
+    else:
+        product_ids = list(pk_set)
+    touch_products(product_ids)
+    cache.bump("catalog")
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # Любой вход, в том числе через админку: анонимная корзина переходит к пользователю
+    if request is None:
+        return
+    if merge_session_cart(request, user):
+        messages.success(request, "Товары из корзины сохранены в вашем аккаунте", fail_silently=True)
+    if CART_COOKIE_NAME in request.COOKIES:
+        # Перенесённая cookie больше не нужна: CartCookieMiddleware удалит её в ответе, иначе
+        # после выхода корзина «вернулась» бы и перешла к следующему вошедшему
+        request.drop_cart_cookie = True
@@ -0,0 +1,14 @@
+from django.apps import apps
+
+from .images import refresh_variants
+from .jobs import task
+from .signals import invalidate_page_cache
+
+
+@task("images.build_variants")
+def build_image_variants(model, pk):
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is not None:
+        if refresh_variants(instance):
+            # refresh_variants сохраняет через update(), сигналы не срабатывают
+            invalidate_page_cache(type(instance), instance)
@@ -0,0 +1,52 @@
+from django import template
+
+from shop import cache, images
+
+register = template.Library()
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = cache.make_key(self.name, *(value.resolve(context) for value in self.vary_on))
+        return cache.get_or_compute(key, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def cachefragment(parser, token):
+    """{% cachefragment "имя" ключ… %}…{% endcachefragment %} — как {% cache %},
+    но с защитой от лавины и счётчиками попаданий из shop.cache."""
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'cachefragment' требует имя фрагмента")
+    nodelist = parser.parse(("endcachefragment",))
+    parser.delete_first_token()
+    return CacheFragmentNode(
+        nodelist, bits[1].strip("\"'"), [parser.compile_filter(bit) for bit in bits[2:]]
+    )
+
+
+@register.filter
+def srcset(variants, fmt="webp"):
+    return images.srcset(variants, fmt)
+
+
+@register.inclusion_tag("picture.html")
+def picture(image, variants, alt="", sizes="100vw", css_class="", style=""):
+    sources = []
+    for fmt in ("avif", "webp"):
+        value = images.srcset(variants, fmt)
+        if value:
+            sources.append({"type": images.MIME_TYPES[fmt], "srcset": value})
+    return {
+        "image": image,
+        "sources": sources,
+        "alt": alt,
+        "sizes": sizes,
+        "css_class": css_class,
+        "style": style,
+    }
@@ -1,3 +1,1311 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.template import engines
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image, features
+
+from . import cache as page_cache, images, jobs, loadtest, profiling
+from .analytics import rebuild_sales, sales_summary
+from .cart import COOKIE_NAME as CART_COOKIE_NAME
+from .feeds import render_feed
+from .importer import ProductImporter
+from .changefeed import SETTLE_LAG, order_changes
+from .models import (
+    Cart,
+    CartItem,
+    Category,
+    CategorySales,
+    Comment,
+    DailySales,
+    Job,
+    Order,
+    OrderItem,
+    OrderSalesCategory,
+    PriceBucket,
+    Product,
+)
+from .nplusone import NPlusOneDetected, detect
+from .search import search_products
+from .services import EmptyCart, checkout
+from .timing import RequestTiming, wrap_connections
+from .views import COMMENT_ORDERING, COMMENTS_PER_PAGE, PRODUCT_ORDERINGS
+
+# Потолок времени ответа: ловит только грубые регрессии, на медленной машине CI тест не падает
+LATENCY_CEILING = 1.0
+
+
+def setUpModule():
+    # Строка лога shop.timing на каждый запрос засорила бы вывод тестов
+    timing_logger = logging.getLogger("shop.timing")
+    unittest.addModuleCleanup(timing_logger.setLevel, timing_logger.level)
+    timing_logger.setLevel(logging.WARNING)
+
+    # Загрузки и варианты изображений пишутся во временный каталог, а не в отслеживаемый media/
+    media_root = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = override_settings(MEDIA_ROOT=media_root)
+    media.enable()
+    unittest.addModuleCleanup(media.disable)
+
+
+class QueryBudgetTests(TestCase):
+    """Каждый маршрут укладывается в фиксированное число SQL-запросов.
+
+    Запросы меряются дважды: на исходных данных и после grow(), который добавляет
+    товары, комментарии, заказы и позиции корзины. Число запросов не должно вырасти —
+    иначе в странице появился запрос на каждую строку (N+1).
+    """
+
+    CATEGORIES = 3
+    PRODUCTS_PER_CATEGORY = 40
+    ORDERS = 30
+    LINES_PER_ORDER = 3
+    CART_LINES = 8
+    COMMENTS = 25
+
+    # Маршрут -> (метод, бюджет запросов). Сессия и пользователь — уже 2 запроса
+    BUDGETS = {
+        "index": ("GET", 8),
+        "category_products": ("GET", 8),
+        "search": ("GET", 5),
+        "cache_stats": ("GET", 2),
+        "product_feed": ("GET", 2),
+        "order_changes": ("GET", 4),
+        "sales_dashboard": ("GET", 5),
+        "product_detail": ("GET", 6),
+        "product_comments": ("GET", 2),
+        "add_product": ("GET", 3),
+        "profile": ("GET", 5),
+        "order_detail": ("GET", 6),
+        "cart": ("GET", 5),
+        # Оплата и отмена обновляют сводки продаж: по INSERT и UPDATE на таблицу сводок
+        # и запомненные категории заказа. Каждое сохранение заказа перечитывает version
+        "pay": ("POST", 15),
+        "cancel": ("POST", 15),
+        "set_pending": ("POST", 8),
+        "add_to_cart": ("POST", 5),
+        "delete_from_cart": ("POST", 4),
+        "cart_add_amount": ("POST", 4),
+        "cart_remove_amount": ("POST", 4),
+    }
+    ADMIN_BUDGETS = {
+        "product": 5,
+        "comment": 4,
+        "category": 5,
+        "cart": 4,
+        "cartitem": 4,
+        "order": 4,
+        "orderitem": 4,
+        "job": 6,
+        "dailysales": 7,
+        "categorysales": 8,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("staff", "staff@example.com", "password")
+        cls.categories = [
+            Category.objects.create(name=f"Категория {i}", slug=f"category-{i}")
+            for i in range(cls.CATEGORIES)
+        ]
+        cls.product = cls.add_products(cls.PRODUCTS_PER_CATEGORY)[0]
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.add_rows(cls.ORDERS, cls.CART_LINES, cls.COMMENTS)
+
+    @classmethod
+    def add_products(cls, per_category):
+        start = Product.objects.count()
+        products = []
+        for i in range(start, start + per_category * len(cls.categories)):
+            product = Product.objects.create(
+                name=f"Велосипед {i}", slug=f"bike-{i}", price=100 + i, description="Городской"
+            )
+            # Часть товаров в нескольких категориях: Product.cats в шаблоне не должен давать N+1
+            product.categories.set(cls.categories[: i % len(cls.categories) + 1])
+            products.append(product)
+        return products
+
+    @classmethod
+    def add_rows(cls, orders, cart_lines, comments):
+        products = list(Product.objects.order_by("pk"))
+        for i in range(orders):
+            order = Order.objects.create(
+                user=cls.user,
+                first_name="Иван",
+                last_name="Петров",
+                email="ivan@example.com",
+                phone="+375291234567",
+                address_street="Ленина",
+                status="confirmed" if i % 2 else "pending",
+            )
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product=product, quantity=2, unit_price=product.price)
+                    for product in products[i : i + cls.LINES_PER_ORDER]
+                ]
+            )
+            order.refresh_subtotal()
+            order.save()
+        in_cart = set(cls.cart.items.values_list("product_id", flat=True))
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart=cls.cart, product=product, quantity=1)
+                for product in [p for p in products if p.pk not in in_cart][:cart_lines]
+            ]
+        )
+        for i in range(comments):
+            Comment.objects.create(
+                product=cls.product, user=cls.user, text=f"Отзыв {i}", rating=i % 5 + 1
+            )
+        # Лента изменений отдаёт только заказы старше ORDER_FEED_SETTLE_LAG
+        Order.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+
+    def grow(self):
+        self.add_products(self.PRODUCTS_PER_CATEGORY // 2)
+        self.add_rows(self.ORDERS // 2, self.CART_LINES, self.COMMENTS)
+
+    def setUp(self):
+        # Кэш фрагментов и условные ответы сделали бы число запросов случайным
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def request(self, name):
+        """Запрос к маршруту name: (число SQL-запросов, секунды, ответ)."""
+        # Число запросов зависит от перехода статуса: оплачиваем ожидающий, отменяем подтверждённый
+        status = "confirmed" if name == "cancel" else "pending"
+        order = Order.objects.filter(user=self.user, status=status).order_by("-pk").first()
+        line = self.cart.items.select_related("product").order_by("-pk").first()
+        args = {
+            "category_products": [self.categories[0].slug],
+            "product_detail": [self.product.slug],
+            "product_comments": [self.product.slug],
+            "product_feed": ["xml"],
+            "profile": [self.user.pk],
+            "order_detail": [order.pk],
+            "pay": [order.pk],
+            "cancel": [order.pk],
+            "set_pending": [order.pk],
+            "add_to_cart": [self.product.slug],
+            "delete_from_cart": [line.product.slug],
+            "cart_add_amount": [line.product.slug],
+            "cart_remove_amount": [line.product.slug],
+        }.get(name, [])
+        url = reverse(name, args=args)
+        if name == "search":
+            url += "?q=велосипед"
+        method, _ = self.BUDGETS[name]
+        return self.measure(method, url)
+
+    def measure(self, method, url):
+        cache.clear()
+        started = time.perf_counter()
+        with detect(), CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method.lower())(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return len(queries), time.perf_counter() - started, response
+
+    def assertWithinBudget(self, count, elapsed, response, budget):
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(count, budget)
+        self.assertLess(elapsed, LATENCY_CEILING)
+
+    def test_views(self):
+        for name, (_, budget) in self.BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertWithinBudget(*self.request(name), budget)
+
+    def test_admin_changelists(self):
+        for model, budget in self.ADMIN_BUDGETS.items():
+            with self.subTest(model=model):
+                self.assertWithinBudget(
+                    *self.measure("GET", reverse(f"admin:shop_{model}_changelist")), budget
+                )
+
+    def test_query_count_does_not_grow_with_rows(self):
+        names = list(self.BUDGETS)
+        urls = [reverse(f"admin:shop_{model}_changelist") for model in self.ADMIN_BUDGETS]
+        before = {name: self.request(name)[0] for name in names}
+        before.update({url: self.measure("GET", url)[0] for url in urls})
+        self.grow()
+        for name in names:
+            with self.subTest(view=name):
+                self.assertEqual(self.request(name)[0], before[name])
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.measure("GET", url)[0], before[url])
+
+
+class NPlusOneDetectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Городские", slug="city")
+        for i in range(6):
+            Product.objects.create(name=f"Велосипед {i}", slug=f"bike-{i}", price=100).categories.add(
+                category
+            )
+
+    def test_reports_python_call_site(self):
+        with self.assertRaises(NPlusOneDetected) as caught:
+            with detect():
+                [product.cats for product in Product.objects.all()]
+        problem = caught.exception.problems[0]
+        self.assertEqual(problem["count"], 6)
+        self.assertIn("shop/models.py", problem["sites"][0]["python"])
+
+    def test_reports_template_line(self):
+        template = engines["django"].from_string(
+            "{% for product in products %}\n{{ product.cats }}\n{% endfor %}"
+        )
+        with self.assertRaises(NPlusOneDetected) as caught:
+            with detect():
+                template.render({"products": Product.objects.all()})
+        self.assertTrue(caught.exception.problems[0]["sites"][0]["template"].endswith(":2"))
+
+    def test_prefetch_is_clean(self):
+        with detect() as detector:
+            [product.cats for product in Product.objects.prefetch_related("categories")]
+        self.assertEqual(detector.problems(), [])
+
+    def test_ignores_writes(self):
+        with detect() as detector:
+            for product in Product.objects.all():
+                Product.objects.filter(pk=product.pk).update(rating_count=1)
+        self.assertEqual(detector.problems(), [])
+
+
+class QueryPlanTests(TestCase):
+    """Горячие выборки идут по индексам, а не полным просмотром таблиц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+        cls.cart = Cart.objects.create(user=cls.user)
+        # ANALYZE без данных мог бы оставить планировщику пустую статистику
+        for i in range(50):
+            Product.objects.create(name=f"Товар {i}", slug=f"item-{i}", price=10, is_active=i % 5 != 0)
+        for i in range(20):
+            Comment.objects.create(product=cls.product, user=cls.user, text=f"Отзыв {i}")
+            Order.objects.create(
+                user=cls.user,
+                first_name="Иван",
+                last_name="Петров",
+                email="ivan@example.com",
+                phone="+375291234567",
+                address_street="Ленина",
+            )
+        CartItem.objects.create(cart=cls.cart, product=cls.product, quantity=1)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, *indexes):
+        if connection.vendor == "postgresql":
+            # На маленьких таблицах PostgreSQL честно выбирает Seq Scan; проверяем, что индекс подходит
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertTrue(any(index in plan for index in indexes), plan)
+
+    def test_catalog_listing(self):
+        products = Product.objects.active().order_by(*PRODUCT_ORDERINGS["new"])[:21]
+        self.assertUsesIndex(products, "shop_product_active_new_idx")
+
+    def test_product_comments(self):
+        comments = Comment.objects.filter(product=self.product).order_by(*COMMENT_ORDERING)[:11]
+        self.assertUsesIndex(comments, "shop_comment_product_new_idx")
+
+    def test_profile_orders(self):
+        orders = Order.objects.filter(user=self.user).order_by("-created_at")
+        self.assertUsesIndex(orders, "shop_order_user_created_idx")
+
+    def test_cart_line(self):
+        items = CartItem.objects.filter(cart=self.cart, product=self.product)
+        # В SQLite уникальное ограничение — автоматический индекс со своим именем
+        self.assertUsesIndex(items, "shop_cartitem_unique_product", "sqlite_autoindex_shop_cartitem")
+
+
+class CommentRatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def post_comment(self, rating):
+        return self.client.post(
+            reverse("product_detail", args=[self.product.slug]), {"text": "Отличный", "rating": rating}
+        )
+
+    def test_form_renders_rating(self):
+        response = self.client.get(reverse("product_detail", args=[self.product.slug]))
+        self.assertContains(response, 'name="rating"')
+
+    def test_posted_rating_updates_product(self):
+        self.assertRedirects(self.post_comment(4), reverse("product_detail", args=[self.product.slug]))
+        self.post_comment(2)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (2, 6))
+        self.assertEqual((self.product.rating_4, self.product.rating_2), (1, 1))
+        self.assertEqual(self.product.rating_avg, 3.0)
+
+    def test_invalid_rating_is_rejected(self):
+        response = self.post_comment(7)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_rebuild_ratings_repairs_counters(self):
+        self.post_comment(5)
+        Product.objects.update(rating_count=10, rating_sum=3, rating_5=0)
+        call_command("rebuild_ratings", stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (1, 5))
+        self.assertEqual((self.product.rating_5, self.product.rating_avg), (1, 5.0))
+
+
+class CommentPagingTests(TestCase):
+    """Кнопка «Показать ещё»: курсор из фрагмента ведёт на следующую страницу без пропусков."""
+
+    MORE_URL = re.compile(r'data-url="([^"]+)"')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+        cls.comments = [
+            Comment.objects.create(product=cls.product, user=cls.user, text=f"Отзыв {i}")
+            for i in range(COMMENTS_PER_PAGE * 2 + 5)
+        ]
+        # Граница страниц проходит внутри группы с одинаковым временем: порядок в ней задаёт id
+        same_time = timezone.now() - timedelta(days=1)
+        Comment.objects.filter(pk__in=[c.pk for c in cls.comments[10:30]]).update(created_at=same_time)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_load_more_pages_through_all_comments(self):
+        response = self.client.get(reverse("product_detail", args=[self.product.slug]))
+        seen = [comment.pk for comment in response.context["comments"]]
+        pages = 1
+        url = self.MORE_URL.search(response.content.decode())
+        while url:
+            response = self.client.get(url.group(1).replace("&amp;", "&"))
+            self.assertEqual(response.status_code, 200)
+            # Ответ — фрагмент списка без обвязки страницы
+            self.assertNotContains(response, "<html")
+            self.assertTemplateUsed(response, "comment_list.html")
+            seen += [comment.pk for comment in response.context["comments"]]
+            pages += 1
+            url = self.MORE_URL.search(response.content.decode())
+
+        expected = list(
+            Comment.objects.filter(product=self.product).order_by(*COMMENT_ORDERING).values_list("pk", flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+        # На последней странице ссылки «Показать ещё» нет
+        self.assertNotContains(response, "load-more-comments")
+
+    def test_fallback_link_continues_from_cursor(self):
+        response = self.client.get(reverse("product_comments", args=[self.product.slug]))
+        first_page = [comment.pk for comment in response.context["comments"]]
+        cursor = response.context["comments"].next_cursor
+        response = self.client.get(reverse("product_detail", args=[self.product.slug]), {"comments": cursor})
+        second_page = [comment.pk for comment in response.context["comments"]]
+        self.assertEqual(len(second_page), COMMENTS_PER_PAGE)
+        self.assertFalse(set(first_page) & set(second_page))
+
+
+class ConditionalCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Велосипеды", slug="bikes")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+        cls.product.categories.add(cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def etag(self, url):
+        # Первый ответ может выдать cookie CSRF, а она входит в ETag
+        self.client.get(url)
+        return self.client.get(url)["ETag"]
+
+    def test_matching_etag_returns_304_with_one_query(self):
+        for url in (reverse("index"), reverse("category_products", args=[self.category.slug])):
+            with self.subTest(url=url):
+                etag = self.etag(url)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                # Только агрегат состояния каталога
+                self.assertEqual(len(queries), 1)
+
+    def test_product_edit_changes_etag(self):
+        url = reverse("index")
+        etag = self.etag(url)
+        self.product.name = "Горный велосипед"
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Горный велосипед")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_write_in_another_process_invalidates(self):
+        url = reverse("index")
+        etag = self.etag(url)
+        # Запись обрабатывает другой процесс со своим локальным кэшем: наш кэш о ней не знает
+        other = LocMemCache("other-process", {})
+        with mock.patch("shop.cache.cache", other):
+            Product.objects.create(name="Самокат", slug="scooter", price=50).categories.add(self.category)
+            self.product.name = "Горный велосипед"
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Горный велосипед")
+        self.assertContains(response, "Самокат")
+
+    def test_last_modified(self):
+        response = self.client.get(reverse("index"))
+        self.product.refresh_from_db()
+        self.assertEqual(response["Last-Modified"], http_date(self.product.updated_at.timestamp()))
+
+
+class CheckoutTests(TestCase):
+    ORDER_DATA = {
+        "first_name": "Иван",
+        "last_name": "Петров",
+        "email": "ivan@example.com",
+        "phone": "+375291234567",
+        "address_street": "Ленина",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.products = [
+            Product.objects.create(name=f"Товар {i}", slug=f"product-{i}", price=10 + i) for i in range(20)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count):
+        CartItem.objects.filter(cart=self.cart).delete()
+        CartItem.objects.bulk_create(
+            [CartItem(cart=self.cart, product=product, quantity=2) for product in self.products[:count]]
+        )
+
+    def test_repeated_token_creates_one_order(self):
+        self.fill_cart(3)
+        token = uuid.uuid4()
+        first = checkout(self.cart, dict(self.ORDER_DATA), token)
+        # Корзина уже пуста, но повтор не падает с EmptyCart, а возвращает тот же заказ
+        second = checkout(self.cart, dict(self.ORDER_DATA), token)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.filter(order=first).count(), 3)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCart):
+            checkout(self.cart, dict(self.ORDER_DATA), uuid.uuid4())
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 20):
+            self.fill_cart(size)
+            data = dict(self.ORDER_DATA, checkout_token=uuid.uuid4())
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse("cart"), data)
+            order = Order.objects.get(checkout_token=data["checkout_token"])
+            self.assertRedirects(response, reverse("order_detail", args=[order.pk]), fetch_redirect_response=False)
+            self.assertEqual(order.items.count(), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        # Сессия, пользователь, корзина, блокировка, поиск по токену, позиции, заказ,
+        # позиции заказа, очистка корзины и точки сохранения транзакции
+        self.assertLessEqual(counts[1], 11)
+
+
+class RequestTimingTests(TestCase):
+    def run_queries(self, timing):
+        with wrap_connections(timing):
+            list(Product.objects.all())
+            list(Category.objects.all())
+        return [site for _, _, site in timing.queries]
+
+    def test_call_sites_only_for_slow_queries(self):
+        self.assertEqual(self.run_queries(RequestTiming(slow_after=60, slow_query=60)), [None, None])
+        sites = self.run_queries(RequestTiming(slow_after=60, slow_query=0))
+        self.assertTrue(all(site.startswith("shop/tests.py:") for site in sites), sites)
+
+    def test_call_sites_after_request_became_slow(self):
+        sites = self.run_queries(RequestTiming(slow_after=0))
+        self.assertTrue(all(site and "run_queries" in site for site in sites), sites)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("index"))
+        header = response["Server-Timing"]
+        self.assertIn("db;dur=", header)
+        self.assertRegex(header, r"tpl;dur=(?!0\.0)")
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        categories = [Category.objects.create(name=f"Категория {i}", slug=f"category-{i}") for i in range(3)]
+        cls.order = Order.objects.create(
+            user=cls.user,
+            first_name="Иван",
+            last_name="Петров",
+            email="ivan@example.com",
+            phone="+375291234567",
+            address_street="Ленина",
+        )
+        for i, category in enumerate(categories):
+            product = Product.objects.create(name=f"Товар {i}", slug=f"product-{i}", price=10 * (i + 1))
+            # Товар в двух категориях учитывается в сводке каждой из них
+            product.categories.set(categories[i : i + 2])
+            OrderItem.objects.create(order=cls.order, product=product, quantity=i + 1, unit_price=product.price)
+        cls.order.refresh_subtotal()
+        cls.order.save()
+
+    def snapshot(self):
+        return (
+            list(DailySales.objects.values_list("date", "order_count", "item_count", "revenue")),
+            list(
+                CategorySales.objects.order_by("category_id").values_list(
+                    "date", "category_id", "item_count", "revenue"
+                )
+            ),
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        rebuild_sales()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_confirm_and_cancel_match_rebuild(self):
+        self.order.status = "confirmed"
+        self.order.save()
+        self.assertEqual(CategorySales.objects.count(), 3)
+        self.assertMatchesRebuild()
+
+        self.order.status = "canceled"
+        self.order.save()
+        self.assertEqual(set(CategorySales.objects.values_list("item_count", flat=True)), {0})
+        self.assertEqual(DailySales.objects.get().order_count, 0)
+
+    def test_stale_instances_do_not_double_count(self):
+        # Два запроса загрузили заказ до подтверждения и оба сохраняют его подтверждённым
+        first, second = Order.objects.get(pk=self.order.pk), Order.objects.get(pk=self.order.pk)
+        for order in (first, second):
+            order.status = "confirmed"
+            order.save()
+        self.assertEqual(DailySales.objects.get().order_count, 1)
+        self.assertMatchesRebuild()
+
+    def test_cancel_after_recategorisation(self):
+        self.order.status = "confirmed"
+        self.order.save()
+        product = self.order.items.order_by("pk").first().product
+        product.categories.set([Category.objects.get(slug="category-2")])
+        self.order.status = "canceled"
+        self.order.save()
+        # Вычитается то, что было прибавлено при подтверждении, а не по новым категориям
+        self.assertEqual(set(CategorySales.objects.values_list("item_count", "revenue")), {(0, 0)})
+        self.assertFalse(OrderSalesCategory.objects.exists())
+
+    def test_dashboard_groups_by_category(self):
+        # Одинаковые названия не должны склеивать разные категории
+        Category.objects.filter(slug="category-1").update(name="Категория 0")
+        self.order.status = "confirmed"
+        self.order.save()
+        today = timezone.localdate()
+        self.assertEqual(len(sales_summary(today, today)["categories"]), 3)
+
+
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, name):
+        return self.client.post(reverse(name, args=[self.product.slug]))
+
+    def lines(self):
+        return list(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity"))
+
+    def test_adding_twice_increments_one_line(self):
+        self.post("add_to_cart")
+        self.post("add_to_cart")
+        self.assertEqual(self.lines(), [(self.product.pk, 2)])
+
+    def test_decrease_to_zero_deletes_line(self):
+        self.post("add_to_cart")
+        self.post("cart_add_amount")
+        self.post("cart_remove_amount")
+        self.assertEqual(self.lines(), [(self.product.pk, 1)])
+        self.post("cart_remove_amount")
+        self.assertEqual(self.lines(), [])
+
+
+class CartMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=100)
+
+    def login(self):
+        return self.client.post(reverse("login"), {"username": "buyer", "password": "password"})
+
+    def lines(self):
+        return list(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity"))
+
+    def test_login_sums_quantities(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.product, quantity=1)
+        for _ in range(2):
+            self.client.post(reverse("add_to_cart", args=[self.product.slug]))
+        self.assertEqual(self.login().status_code, 302)
+        self.assertEqual(self.lines(), [(self.product.pk, 3)])
+        self.assertEqual(self.client.cookies[CART_COOKIE_NAME].value, "")
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.post(reverse("add_to_cart", args=[self.product.slug]))
+        signed = self.client.cookies[CART_COOKIE_NAME].value
+        # Подменяем количество, оставив старую подпись
+        self.client.cookies[CART_COOKIE_NAME] = signed.replace(f'"{self.product.pk}":1', f'"{self.product.pk}":50')
+        self.assertNotEqual(self.client.cookies[CART_COOKIE_NAME].value, signed)
+        self.login()
+        self.assertEqual(self.lines(), [])
+
+    def test_admin_login_clears_cookie(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.post(reverse("add_to_cart", args=[self.product.slug]))
+        response = self.client.post(
+            reverse("admin:login"), {"username": "buyer", "password": "password", "next": reverse("admin:index")}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.lines(), [(self.product.pk, 1)])
+        self.assertEqual(self.client.cookies[CART_COOKIE_NAME].value, "")
+
+    def test_second_login_does_not_merge_again(self):
+        self.client.post(reverse("add_to_cart", args=[self.product.slug]))
+        signed = self.client.cookies[CART_COOKIE_NAME].value
+        self.login()
+        self.client.logout()
+        self.login()
+        self.assertEqual(self.lines(), [(self.product.pk, 1)])
+
+        # Клиент сохранил cookie вопреки удалению: повторный вход её не удвоит и снова удалит
+        self.client.logout()
+        self.client.cookies[CART_COOKIE_NAME] = signed
+        response = self.login()
+        self.assertEqual(self.lines(), [(self.product.pk, 1)])
+        self.assertEqual(response.cookies[CART_COOKIE_NAME].value, "")
+
+
+class ImportProductsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Велосипеды", slug="bikes")
+
+    def run_import(self, rows):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "products.jsonl")
+            with open(source, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            stderr = StringIO()
+            call_command("import_products", source, stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def facet_counts(self):
+        return (
+            list(Category.objects.values_list("slug", "product_count")),
+            list(PriceBucket.objects.order_by("pk").values_list("pk", "product_count")),
+        )
+
+    def assertFacetsMatchRebuild(self):
+        counts = self.facet_counts()
+        call_command("rebuild_facets", stdout=StringIO())
+        self.assertEqual(counts, self.facet_counts())
+
+    def test_import_rejects_bad_rows_and_upserts_on_rerun(self):
+        errors = self.run_import(
+            [
+                {"name": "Горный", "slug": "mountain", "price": "100", "categories": ["bikes"]},
+                {"name": "Городской", "price": "50,5", "categories": "bikes"},
+                # Раньше такие строки падали с TypeError и прерывали весь импорт
+                {"name": "Вложенный список", "price": "10", "categories": [["bikes"]]},
+                {"name": "Число", "price": "10", "categories": 5},
+                {"name": "Без цены"},
+                {"price": "10"},
+            ]
+        )
+        self.assertEqual(len(errors.splitlines()), 4, errors)
+        self.assertIn("Строка 3: categories", errors)
+        self.assertEqual(
+            set(Product.objects.values_list("name", "price")),
+            {("Горный", Decimal("100.00")), ("Городской", Decimal("50.50"))},
+        )
+        self.assertFacetsMatchRebuild()
+
+        self.run_import([{"name": "Горный 2024", "slug": "mountain", "price": "300", "is_active": "нет"}])
+        product = Product.objects.get(slug="mountain")
+        self.assertEqual((product.name, product.price, product.is_active), ("Горный 2024", Decimal("300.00"), False))
+        self.assertFalse(product.categories.exists())
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertFacetsMatchRebuild()
+
+    def test_repeated_slug_in_chunk_creates_one_product(self):
+        self.run_import(
+            [
+                {"name": "Горный", "slug": "mountain", "price": "100", "categories": ["bikes"]},
+                {"name": "Горный 2024", "slug": "mountain", "price": "300", "categories": ["bikes"]},
+            ]
+        )
+        self.assertEqual(list(Product.objects.values_list("slug", "price")), [("mountain", Decimal("300.00"))])
+        self.assertFacetsMatchRebuild()
+
+    def test_images_are_written_after_commit(self):
+        # Уникальное имя: каталог MEDIA_ROOT общий для всех тестов модуля
+        filename = f"{uuid.uuid4().hex}.png"
+        with tempfile.TemporaryDirectory() as images_dir:
+            with open(os.path.join(images_dir, filename), "wb") as f:
+                Image.new("RGB", (10, 10)).save(f, format="PNG")
+            importer = ProductImporter(images_dir)
+            rows = [
+                importer.clean({"name": name, "price": "100", "image": filename})
+                for name in ("Горный", "Городской")
+            ]
+
+            # Пачка откатилась: товаров нет, и файлы в хранилище не появились
+            with mock.patch("shop.importer.facets.change_bucket_count", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+                    importer.import_chunk(rows)
+            self.assertFalse(Product.objects.exists())
+            self.assertFalse(default_storage.exists(f"images/products/{filename}"))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                importer.import_chunk(rows)
+        names = sorted(Product.objects.values_list("image", flat=True))
+        self.assertEqual(len(set(names)), 2)
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        self.assertEqual(
+            sorted(job.payload["pk"] for job in Job.objects.filter(name="images.build_variants")),
+            sorted(Product.objects.values_list("pk", flat=True)),
+        )
+
+
+class JobQueueTests(TestCase):
+    def register(self, name, func):
+        jobs.task(name)(func)
+        self.addCleanup(jobs.registry.pop, name)
+
+    def test_worker_pass_runs_job_once(self):
+        calls = []
+        self.register("tests.record", lambda value: calls.append(value))
+        job = jobs.enqueue("tests.record", {"value": 7})
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(calls, [7])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), ("done", 1, ""))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failed_job_is_rescheduled_with_backoff(self):
+        def fail():
+            raise RuntimeError("нет связи")
+
+        self.register("tests.fail", fail)
+        job = jobs.enqueue("tests.fail", max_attempts=2)
+        started = timezone.now()
+        with self.assertLogs("shop.jobs", "WARNING"):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+        self.assertIn("RuntimeError: нет связи", job.last_error)
+        delay = (job.run_at - started).total_seconds()
+        self.assertGreaterEqual(delay, jobs.RETRY_BACKOFF * 0.8)
+        self.assertLessEqual(delay, jobs.RETRY_BACKOFF * 1.2 + 1)
+        # До run_at задачу не забирает ни один проход воркера
+        self.assertEqual(jobs.run_pending(), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_at=started)
+        with self.assertLogs("shop.jobs", "WARNING"):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+
+
+class FacetCounterTests(TestCase):
+    """Счётчики фильтров, которые ведут сигналы, совпадают с полным пересчётом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = Category.objects.create(name="Городские", slug="city")
+        cls.mountain = Category.objects.create(name="Горные", slug="mountain")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=70)
+        cls.product.categories.add(cls.city)
+
+    def counts(self):
+        return (
+            dict(Category.objects.values_list("slug", "product_count")),
+            dict(PriceBucket.objects.filter(product_count__gt=0).values_list("bucket", "product_count")),
+        )
+
+    def assertCounts(self, categories, buckets):
+        self.assertEqual(self.counts(), (categories, buckets))
+        call_command("rebuild_facets", stdout=StringIO())
+        self.assertEqual(self.counts(), (categories, buckets))
+
+    def test_initial_counts(self):
+        self.assertCounts({"city": 1, "mountain": 0}, {1: 1})
+
+    def test_add_and_remove_category(self):
+        self.product.categories.add(self.mountain)
+        self.assertCounts({"city": 1, "mountain": 1}, {1: 1})
+        self.product.categories.remove(self.city)
+        self.assertCounts({"city": 0, "mountain": 1}, {1: 1})
+        self.mountain.product_set.clear()
+        self.assertCounts({"city": 0, "mountain": 0}, {1: 1})
+
+    def test_deactivate_and_reactivate(self):
+        self.product.is_active = False
+        self.product.save()
+        self.assertCounts({"city": 0, "mountain": 0}, {})
+        # Категории неактивного товара не считаются, пока его не включат
+        self.product.categories.add(self.mountain)
+        self.assertCounts({"city": 0, "mountain": 0}, {})
+        self.product.is_active = True
+        self.product.save()
+        self.assertCounts({"city": 1, "mountain": 1}, {1: 1})
+
+    def test_price_bucket_change(self):
+        self.product.price = 700
+        self.product.save()
+        self.assertCounts({"city": 1, "mountain": 0}, {3: 1})
+        self.product.delete()
+        self.assertCounts({"city": 0, "mountain": 0}, {})
+
+
+class PageCacheInvalidationTests(TestCase):
+    """Правки данных видны сразу, хотя страницы отдаются из кэша; кэш между запросами не чистится."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "password")
+        cls.category = Category.objects.create(name="Городские", slug="city")
+        cls.product = Product.objects.create(name="Велосипед", slug="bike", price=70)
+        cls.product.categories.add(cls.category)
+
+    def setUp(self):
+        # Только до первого запроса: дальше кэш должен инвалидироваться сам
+        cache.clear()
+
+    def warm(self, url, text):
+        self.assertContains(self.client.get(url), text)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(url), text)
+        return len(queries)
+
+    def test_product_edit_reaches_cached_pages(self):
+        urls = [
+            reverse("index"),
+            reverse("category_products", args=[self.category.slug]),
+            reverse("product_detail", args=[self.product.slug]),
+        ]
+        warm_queries = [self.warm(url, "Велосипед") for url in urls]
+        # Повторный запрос каталога обслуживается кэшем: только агрегат состояния каталога
+        self.assertEqual(warm_queries[0], 1)
+
+        self.product.name = "Самокат"
+        self.product.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, "Самокат")
+                self.assertNotContains(response, "Велосипед")
+
+    def test_category_rename_reaches_index(self):
+        self.warm(reverse("index"), "Городские")
+        self.category.name = "Прогулочные"
+        self.category.save()
+        self.assertContains(self.client.get(reverse("index")), "Прогулочные")
+
+    def test_new_comment_reaches_comment_list(self):
+        self.client.force_login(self.user)
+        url = reverse("product_comments", args=[self.product.slug])
+        self.client.get(url)
+        Comment.objects.create(product=self.product, user=self.user, text="Едет отлично", rating=5)
+        self.assertContains(self.client.get(url), "Едет отлично")
+
+    def test_unknown_params_share_fragment(self):
+        self.warm(reverse("index") + "?sort=new", "Велосипед")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("index") + "?utm_source=mail&sort=new&cursor=garbage")
+        self.assertEqual(len(queries), 1)
+        self.assertNotContains(response, "utm_source")
+
+    def test_variant_build_reaches_cached_pages(self):
+        Product.objects.filter(pk=self.product.pk).update(image="images/products/bike.png")
+        before = page_cache.generation("catalog")
+        with mock.patch("shop.management.commands.build_image_variants.refresh_variants", return_value=True):
+            call_command("build_image_variants", stdout=StringIO())
+        self.assertNotEqual(page_cache.generation("catalog"), before)
+
+
+class OrderChangeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("staff", "staff@example.com", "password")
+        cls.orders = [
+            Order.objects.create(
+                user=cls.user,
+                first_name="Иван",
+                last_name="Петров",
+                email="ivan@example.com",
+                phone="+375291234567",
+                address_street="Ленина",
+            )
+            for _ in range(5)
+        ]
+        # Два заказа с одинаковым updated_at: порядок внутри пары задаёт id
+        past = timezone.now() - timedelta(hours=1)
+        for i, order in enumerate(cls.orders):
+            Order.objects.filter(pk=order.pk).update(updated_at=past + timedelta(minutes=i // 2 * 2))
+
+    def read_all(self, cursor=None, limit=2):
+        seen = []
+        while True:
+            batch = order_changes(cursor, limit)
+            seen += [order["id"] for order in batch["orders"]]
+            cursor = batch["cursor"]
+            if not batch["has_more"]:
+                return seen, cursor
+
+    def test_cursor_walks_every_order_once(self):
+        # При limit=3 граница пачки проходит между заказами с одинаковым updated_at
+        for limit in (2, 3):
+            with self.subTest(limit=limit):
+                seen, cursor = self.read_all(limit=limit)
+                self.assertEqual(seen, [order.pk for order in self.orders])
+        # Пустая пачка не сдвигает курсор
+        self.assertEqual(order_changes(cursor), {"orders": [], "cursor": cursor, "has_more": False})
+
+    def test_changed_order_is_delivered_again_after_settle_lag(self):
+        _, cursor = self.read_all()
+        order = self.orders[0]
+        order.status = "confirmed"
+        order.save()
+        # Только что изменённый заказ ещё не отдаётся: его транзакция могла не зафиксироваться
+        self.assertEqual(order_changes(cursor)["orders"], [])
+
+        later = timezone.now() + timedelta(seconds=SETTLE_LAG + 1)
+        with mock.patch("shop.changefeed.timezone.now", return_value=later):
+            batch = order_changes(cursor)
+        self.assertEqual(
+            [(change["id"], change["version"], change["status"]) for change in batch["orders"]],
+            [(order.pk, 2, "confirmed")],
+        )
+
+    def test_stale_copies_do_not_reuse_version(self):
+        first = Order.objects.get(pk=self.orders[0].pk)
+        second = Order.objects.get(pk=self.orders[0].pk)
+        first.save()
+        second.save(update_fields=["status"])
+        self.assertEqual((first.version, second.version), (2, 3))
+        self.assertEqual(Order.objects.get(pk=first.pk).version, 3)
+
+    def test_api_rejects_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("order_changes"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("order_changes"), {"limit": 3})
+        self.assertEqual(len(response.json()["orders"]), 3)
+
+
+class LoadTestCommandTests(TestCase):
+    @override_settings(DEBUG=False)
+    def test_refuses_without_debug(self):
+        with self.assertRaisesMessage(CommandError, "--i-know"):
+            call_command("loadtest", iterations=1, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith=loadtest.USER_PREFIX).exists())
+
+    def test_users_without_password_cannot_log_in(self):
+        user = loadtest.loadtest_users(1)[0]
+        self.assertFalse(user.has_usable_password())
+        user = loadtest.loadtest_users(1, "secret-from-env")[0]
+        self.assertTrue(user.check_password("secret-from-env"))
+
+    def test_summary_without_successful_samples(self):
+        report = {
+            "views": {},
+            "total": {
+                "requests": 0, "errors": 0, "rps": None, "p50_ms": None, "p95_ms": None,
+                "p99_ms": None, "queries_max": None,
+            },
+        }
+        baseline = {"views": {}, "total": {"p95_ms": 10}}
+        stderr = StringIO()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(loadtest, "run", return_value=report):
+            path = os.path.join(tmp, "baseline.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(baseline, f)
+            call_command("loadtest", baseline=path, i_know=True, stdout=StringIO(), stderr=stderr)
+        self.assertIn("total", stderr.getvalue())
+
+
+class LoadTestRunTests(TransactionTestCase):
+    # Потоки теста ходят в базу своими соединениями и не видят транзакцию TestCase
+
+    def setUp(self):
+        Product.objects.create(name="Велосипед", slug="bike", price=100).categories.add(
+            Category.objects.create(name="Городские", slug="city")
+        )
+
+    def test_journey_exception_is_counted(self):
+        def broken(session, catalog, rng, record):
+            record("index", session.request("GET", reverse("index")))
+            raise ConnectionResetError
+
+        with mock.patch.dict(loadtest.JOURNEYS, {"browse": broken}), self.assertLogs("shop.loadtest", "ERROR"):
+            report = loadtest.run(workers=1, iterations=3, mix={"browse": 1})
+        self.assertEqual(report["journey_errors"], {"browse": 3, "login": 0})
+        self.assertEqual(report["views"]["index"]["requests"], 3)
+        self.assertEqual(report["total"]["errors"], 3)
+
+    def test_failed_login_is_counted(self):
+        with mock.patch.object(loadtest, "InProcessSession", side_effect=ConnectionRefusedError), self.assertLogs(
+            "shop.loadtest", "ERROR"
+        ):
+            report = loadtest.run(workers=2, iterations=1)
+        self.assertEqual(report["journey_errors"]["login"], 2)
+        self.assertEqual(report["total"]["errors"], 2)
+        self.assertLessEqual(report["started_at"], timezone.now().isoformat())
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.in_name = Product.objects.create(
+            name="Горный велосипед", slug="mountain", price=100, description="Для трасс"
+        )
+        cls.in_description = Product.objects.create(
+            name="Шлем", slug="helmet", price=30, description="Защита для езды на велосипеде"
+        )
+        Product.objects.create(
+            name="Велосипед из архива", slug="archived", price=50, is_active=False
+        )
+        Product.objects.create(name="Самокат", slug="scooter", price=80)
+
+    def require_fts(self):
+        # Ранжирование и стемминг есть только у индексов PostgreSQL и SQLite FTS5;
+        # на остальных бэкендах поиск — icontains без порядка по релевантности
+        if connection.vendor == "postgresql":
+            return
+        if connection.vendor != "sqlite" or "shop_product_fts" not in connection.introspection.table_names():
+            self.skipTest("нет полнотекстового индекса")
+
+    def test_name_match_ranks_above_description(self):
+        self.require_fts()
+        page = search_products("велосипеды")
+        self.assertEqual(page.object_list, [self.in_name, self.in_description])
+        self.assertFalse(page.has_next)
+
+    def test_empty_query_searches_nothing(self):
+        for query in ("", "   ", "\t\n"):
+            with self.subTest(query=query), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("search"), {"q": query})
+                self.assertIsNone(response.context["products"])
+                self.assertNotContains(response, "ничего не найдено")
+                self.assertFalse([q for q in queries if "shop_product" in q["sql"]])
+
+    def test_pages_do_not_overlap(self):
+        self.require_fts()
+        for i in range(3):
+            Product.objects.create(name=f"Велосипед {i}", slug=f"bike-{i}", price=100)
+        seen, page_number = [], 1
+        while True:
+            page = search_products("велосипед", page_number, per_page=2)
+            self.assertLessEqual(len(page), 2)
+            seen += [product.pk for product in page]
+            if not page.has_next:
+                break
+            page_number += 1
+        self.assertEqual(page_number, 3)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(
+            set(seen),
+            set(Product.objects.active().filter(slug__startswith="bike").values_list("pk", flat=True))
+            | {self.in_name.pk, self.in_description.pk},
+        )
+        self.assertFalse(search_products("велосипед", page_number + 1, per_page=2))
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        buffer = BytesIO()
+        Image.new("RGB", (500, 250), "red").save(buffer, format="PNG")
+        name = default_storage.save("images/products/bike.png", ContentFile(buffer.getvalue()))
+        self.product = Product.objects.create(name="Велосипед", slug="bike", price=100, image=name)
+
+    @unittest.skipUnless(features.check("webp"), "Pillow без поддержки WebP")
+    def test_variant_sizes_and_formats(self):
+        data = images.build_variants(self.product.image)
+        self.assertEqual(data["source"], self.product.image.name)
+        # 800 шире исходника и заменяется исходной шириной, картинка не увеличивается
+        self.assertEqual(
+            [(variant["format"], variant["width"], variant["height"]) for variant in data["variants"]],
+            [("webp", 200, 100), ("webp", 400, 200), ("webp", 500, 250)],
+        )
+        for variant in data["variants"]:
+            with default_storage.open(variant["name"]) as f, Image.open(f) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (variant["width"], variant["height"]))
+
+    def render(self, variants):
+        template = engines["django"].from_string(
+            "{% load shop_tags %}{% picture product.image variants alt=product.name %}"
+        )
+        return template.render({"product": self.product, "variants": variants})
+
+    def test_picture_falls_back_to_original(self):
+        for variants in (None, {}, {"source": self.product.image.name, "variants": []}):
+            with self.subTest(variants=variants):
+                html = self.render(variants)
+                self.assertNotIn("<source", html)
+                self.assertIn(f'src="{self.product.image.url}"', html)
+
+    def test_picture_lists_variants(self):
+        variants = {
+            "source": self.product.image.name,
+            "variants": [
+                {"name": "images/products/variants/bike-200w.webp", "format": "webp", "width": 200, "height": 100},
+            ],
+        }
+        html = self.render(variants)
+        url = default_storage.url("images/products/variants/bike-200w.webp")
+        self.assertIn(f'type="image/webp" srcset="{url} 200w"', html)
+        self.assertIn(f'src="{self.product.image.url}"', html)
+
+
+class ProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", "staff@example.com", "password", is_staff=True)
+        cls.buyer = User.objects.create_user("buyer", "buyer@example.com", "password")
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        patcher = mock.patch.object(profiling, "PROFILE_DIR", self.profile_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, **extra):
+        return self.client.get(reverse("index"), {"_profile": "cprofile"}, **extra)
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        responses = [self.get(), self.client.get(reverse("index"), HTTP_X_PROFILE="sample")]
+        for response, extension in zip(responses, (".prof", ".collapsed")):
+            name = response["X-Profile-File"]
+            self.assertTrue(name.endswith(extension))
+            self.assertTrue(os.path.isfile(os.path.join(self.profile_dir, name)))
+
+    def test_others_are_not_profiled(self):
+        for user in (None, self.buyer):
+            with self.subTest(user=user):
+                if user:
+                    self.client.force_login(user)
+                response = self.get()
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("X-Profile-File", response)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("index"), {"_profile": "unknown"})
+        self.assertNotIn("X-Profile-File", response)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_keeps_only_latest_profiles(self):
+        old = []
+        for i in range(3):
+            path = os.path.join(self.profile_dir, f"old-{i}.prof")
+            with open(path, "w"):
+                pass
+            # Время изменения по возрастанию: old-2 — самый свежий из старых
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+            old.append(os.path.basename(path))
+        self.client.force_login(self.staff)
+        with mock.patch.object(profiling, "PROFILE_KEEP", 2):
+            name = self.get()["X-Profile-File"]
+        self.assertEqual(sorted(os.listdir(self.profile_dir)), sorted([name, old[2]]))
+
+
+class ProductFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Городские", slug="city")
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(name=f"Велосипед {i}", slug=f"bike-{i}", price=100 + i)
+            product.categories.add(cls.category)
+            cls.products.append(product)
+        Product.objects.create(name="Снят с продажи", slug="archived", price=50, is_active=False)
+
+    def test_every_format_lists_active_products(self):
+        for fmt in ("csv", "jsonl", "xml"):
+            with self.subTest(fmt=fmt):
+                response = self.client.get(reverse("product_feed", args=[fmt]))
+                self.assertEqual(response.status_code, 200)
+                body = b"".join(response.streaming_content).decode()
+                count = {
+                    "csv": len(body.splitlines()) - 1,
+                    "jsonl": len(body.splitlines()),
+                    "xml": body.count("<offer "),
+                }[fmt]
+                self.assertEqual(count, len(self.products))
+                self.assertNotIn("archived", body)
+
+    def test_chunks_keep_categories(self):
+        # Пачки меньше каталога: категории подгружаются на каждую пачку
+        body = "".join(render_feed("jsonl", "https://shop.example/", chunk_size=2))
+        items = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([item["id"] for item in items], [product.pk for product in self.products])
+        self.assertTrue(all(item["categories"] == ["Городские"] for item in items))
+        self.assertEqual(items[0]["url"], "https://shop.example" + reverse("product_detail", args=["bike-0"]))
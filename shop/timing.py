@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+# Кадры этих файлов не считаются местом вызова: ищем первый кадр кода проекта.
+# Модули с обёртками execute_wrapper добавляют сюда себя
+_PROJECT_DIR = str(settings.BASE_DIR) + os.sep
+SKIP_FILES = {__file__}
+
+current = ContextVar("request_timing", default=None)
+
+
+def call_site(skip=2):
+    """Ближайший к запросу кадр кода проекта в виде "путь:строка функция"."""
+    frame = sys._getframe(skip)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(_PROJECT_DIR)
+            and filename not in SKIP_FILES
+            and "site-packages" not in filename
+        ):
+            return f"{filename[len(_PROJECT_DIR):]}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+@contextmanager
+def wrap_connections(wrapper):
+    """connection.execute_wrapper сразу для всех баз из DATABASES."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield wrapper
+
+
+class RequestTiming:
+    """Счётчики одного запроса: SQL, шаблоны, кэш фрагментов.
+
+    Обход стека ради места вызова дорог, поэтому место ищется только у запросов,
+    выполненных после того, как запрос стал медленным (slow_after, секунды), и у SQL,
+    который сам дольше slow_query. Остальные запросы сохраняются без места.
+    """
+
+    def __init__(self, slow_after=None, slow_query=None):
+        self.started = time.perf_counter()
+        self.slow_after = slow_after
+        self.slow_query = slow_query
+        self.queries = []
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка для connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            finished = time.perf_counter()
+            duration = finished - started
+            self.sql_time += duration
+            if (self.slow_query is not None and duration >= self.slow_query) or (
+                self.slow_after is not None and finished - self.started >= self.slow_after
+            ):
+                self.queries.append((sql, duration, call_site()))
+            else:
+                self.queries.append((sql, duration, None))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def top_queries(self, limit):
+        """Самые дорогие по суммарному времени SQL-запросы с первым известным местом вызова."""
+        grouped = {}
+        for sql, duration, site in self.queries:
+            entry = grouped.setdefault(sql, {"sql": sql, "count": 0, "ms": 0.0, "site": None})
+            entry["count"] += 1
+            entry["ms"] += duration * 1000
+            entry["site"] = entry["site"] or site
+        top = sorted(grouped.values(), key=lambda entry: entry["ms"], reverse=True)[:limit]
+        for entry in top:
+            entry["ms"] = round(entry["ms"], 2)
+        return top
+
+
+def note_cache(hit):
+    timing = current.get()
+    if timing is not None:
+        if hit:
+            timing.cache_hits += 1
+        else:
+            timing.cache_misses += 1
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, *args, **kwargs):
+        timing = current.get()
+        if timing is None:
+            return render(self, *args, **kwargs)
+        # Вложенный render_to_string уже учтён во внешнем шаблоне
+        timing.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            timing.template_depth -= 1
+            if not timing.template_depth:
+                timing.template_time += time.perf_counter() - started
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_templates():
+    """Подключает замер времени шаблонов Django; вызывается из ShopConfig.ready()."""
+    if not getattr(Template.render, "timed", False):
+        Template.render = _timed_render(Template.render)
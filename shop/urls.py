@@ -8,7 +8,13 @@ from django.conf import settings
 urlpatterns = [
     path("", views.index, name="index"),
     path("category/<slug:slug>/", views.category_products, name="category_products"),
+    path("search/", views.search, name="search"),
+    path("cache/stats/", views.cache_stats, name="cache_stats"),
+    path("feed/<str:fmt>/", views.product_feed, name="product_feed"),
+    path("api/orders/changes/", views.order_changes_api, name="order_changes"),
+    path("dashboard/sales/", views.sales_dashboard, name="sales_dashboard"),
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
+    path("product/<slug:slug>/comments/", views.product_comments, name="product_comments"),
     path("add/", views.add_product, name="add_product"),
     path("profile/<int:pk>/", views.profile, name="profile"),
     path("order/<int:pk>/", views.order_detail, name="order_detail"),
@@ -1,178 +1,368 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, Category, Comment, Cart, CartItem, Order, OrderItem
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.formats import localize
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_POST
+from .models import PRICE_BUCKETS, Product, Category, Comment, Order
 from .forms import AddProduct, CommentForm, CustomRegister, CustomLogin, OrderConfirm
+from .facets import filter_by_facets, price_facets
+from .pagination import InvalidCursor, decode_cursor, keyset_paginate
+from .search import search_products
+from .feeds import FORMATS as FEED_FORMATS, render_feed
+from .changefeed import BATCH_SIZE as CHANGES_BATCH_SIZE, order_changes
+from .analytics import sales_summary
+from .cart import get_cart
+from .services import EmptyCart, checkout
+from . import cache as page_cache
+from .ratings import histogram
+from .conditional import catalog_state, catalog_version, conditional_page, order_state, product_state
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
 from django.utils.safestring import mark_safe
+from django.utils.functional import SimpleLazyObject
 from django.urls import reverse
-
-
-def index(request):
+from django.utils.http import urlencode
+from django.core.validators import slug_re
+from django.db.models import prefetch_related_objects
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+
+
+PRODUCT_ORDERINGS = {
+    "new": ("-created_at", "-id"),
+    "old": ("created_at", "id"),
+    "rating": ("-rating_avg", "-id"),
+}
+COMMENT_ORDERING = ("-created_at", "-id")
+COMMENTS_PER_PAGE = 10
+
+
+def _product_page(request, get_products, filters=()):
+    """Страница товаров и параметры ссылок на соседние страницы.
+
+    filters — уже разобранные пары (параметр, значение) фильтров страницы. Только они,
+    сортировка и курсор попадают в ссылки пагинации и в ключ кэша фрагмента: посторонние
+    параметры (utm_* и т. п.) не плодят копий фрагмента и не оседают в его ссылках.
+    """
     sort = request.GET.get("sort", "new")
+    if sort not in PRODUCT_ORDERINGS:
+        sort = "new"
+    cursor = request.GET.get("cursor")
+    try:
+        decode_cursor(cursor or "")
+    except InvalidCursor:
+        cursor = None
+
+    def paginate():
+        products = get_products()
+        try:
+            return keyset_paginate(products, PRODUCT_ORDERINGS[sort], cursor)
+        except InvalidCursor:
+            return keyset_paginate(products, PRODUCT_ORDERINGS[sort])
+
+    params = [*filters, ("sort", sort)]
+    # Страница считается лениво: если HTML списка уже в кэше, запросов к товарам не будет
+    return {
+        "products": SimpleLazyObject(paginate),
+        "sort": sort,
+        "base_query": urlencode(params),
+        "fragment_key": urlencode([*params, ("cursor", cursor or "")]),
+    }
+
+
+def _int_list(values):
+    return [int(value) for value in values if value.isdigit()]
+
+
+@conditional_page(catalog_state)
+def index(request):
+    selected_categories = sorted({slug for slug in request.GET.getlist("cat") if slug_re.match(slug)})
+    selected_buckets = sorted(
+        {bucket for bucket in _int_list(request.GET.getlist("price")) if bucket < len(PRICE_BUCKETS)}
+    )
+    mode = "and" if request.GET.get("mode") == "and" else "or"
+    filters = [
+        *(("cat", slug) for slug in selected_categories),
+        *(("price", bucket) for bucket in selected_buckets),
+        ("mode", mode),
+    ]
+
+    def products():
+        category_ids = list(
+            Category.objects.filter(slug__in=selected_categories).values_list("id", flat=True)
+        )
+        return filter_by_facets(
+            Product.objects.active().for_listing(), category_ids, mode, selected_buckets
+        )
 
-    if sort == "old":
-        products = Product.objects.all().order_by("-created_at")
-    else:
-        products = Product.objects.all().order_by("created_at")
-
-    categories = Category.objects.all()
     return render(
         request,
         "index.html",
-        {"products": products, "categories": categories, "sort": sort},
+        {
+            **_product_page(request, products, filters),
+            "categories": Category.objects.all(),
+            "price_facets": SimpleLazyObject(price_facets),
+            "selected_categories": selected_categories,
+            "selected_buckets": selected_buckets,
+            "mode": mode,
+            "catalog_generation": catalog_version(request)[2],
+        },
     )
 
 
+@conditional_page(catalog_state)
 def category_products(request, slug):
-    categories = Category.objects.all()
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(categories=category)
+
+    def products():
+        return Product.objects.active().for_listing().filter(categories=category)
+
     return render(
         request,
         "category.html",
-        {"category": category, "products": products, "categories": categories},
+        {
+            **_product_page(request, products),
+            "category": category,
+            "categories": Category.objects.all(),
+            "catalog_generation": catalog_version(request)[2],
+        },
+    )
+
+
+def search(request):
+    query = request.GET.get("q", "").strip()
+    try:
+        page_number = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page_number = 1
+    products = search_products(query, page_number) if query else None
+    return render(
+        request,
+        "search.html",
+        {"query": query, "products": products},
     )
 
 
+def _comment_page(product, cursor):
+    comments = Comment.objects.filter(product=product).select_related("user")
+    try:
+        return keyset_paginate(comments, COMMENT_ORDERING, cursor, per_page=COMMENTS_PER_PAGE)
+    except InvalidCursor:
+        return keyset_paginate(comments, COMMENT_ORDERING, per_page=COMMENTS_PER_PAGE)
+
+
+@conditional_page(product_state)
 def product_detail(request, slug):
     product = get_object_or_404(Product, slug=slug)
-    comments = Comment.objects.filter(product=product)
     if request.method == "POST":
         form = CommentForm(request.POST)
         if form.is_valid():
-            comments = form.save(commit=False)
-            comments.product = product
-            comments.user = request.user
-            comments.save()
+            comment = form.save(commit=False)
+            comment.product = product
+            comment.user = request.user
+            # Комментарий и счётчики товара фиксируются вместе
+            with transaction.atomic():
+                comment.save()
             return redirect("product_detail", slug=slug)
     else:
         form = CommentForm()
+    cursor = request.GET.get("comments")
     return render(
         request,
         "product_detail.html",
-        {"product": product, "comments": comments, "form": form},
+        {
+            "product": product,
+            "comments": SimpleLazyObject(lambda: _comment_page(product, cursor)),
+            "comments_cursor": cursor,
+            "rating_histogram": histogram(product),
+            "form": form,
+            "comments_generation": page_cache.generation(f"comments:{product.pk}"),
+        },
+    )
+
+
+def product_comments(request, slug):
+    """Следующая страница комментариев для кнопки «Показать ещё»."""
+    product = get_object_or_404(Product.objects.only("id", "slug"), slug=slug)
+    return render(
+        request,
+        "comment_list.html",
+        {"product": product, "comments": _comment_page(product, request.GET.get("cursor"))},
     )
 
 
+@gzip_page
+def product_feed(request, fmt):
+    """Потоковая выгрузка каталога для маркетплейсов: /feed/xml/, /feed/csv/, /feed/jsonl/."""
+    if fmt not in FEED_FORMATS:
+        raise Http404
+    content_type, _ = FEED_FORMATS[fmt]
+    response = StreamingHttpResponse(
+        render_feed(fmt, request.build_absolute_uri("/")),
+        content_type=f"{content_type}; charset=utf-8",
+    )
+    response["Content-Disposition"] = f'inline; filename="products.{fmt}"'
+    return response
+
+
+@staff_member_required
+def order_changes_api(request):
+    """Лента изменений заказов для учётных и складских систем: ?cursor=…&limit=…"""
+    try:
+        limit = int(request.GET.get("limit", CHANGES_BATCH_SIZE))
+    except ValueError:
+        limit = CHANGES_BATCH_SIZE
+    try:
+        return JsonResponse(order_changes(request.GET.get("cursor"), limit))
+    except InvalidCursor:
+        return JsonResponse({"error": "invalid cursor"}, status=400)
+
+
+@staff_member_required
+def sales_dashboard(request):
+    try:
+        days = min(max(int(request.GET.get("days", 30)), 1), 3660)
+    except ValueError:
+        days = 30
+    until = timezone.localdate()
+    since = until - timedelta(days=days - 1)
+    return render(
+        request,
+        "sales_dashboard.html",
+        {**sales_summary(since, until), "since": since, "until": until, "days": days},
+    )
+
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(page_cache.stats())
+
+
 @login_required
 def profile(request, pk):
     if request.user.pk != pk:
         return redirect("index")
-    orders = Order.objects.filter(user=request.user).prefetch_related("items").order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).prefetch_related("items__product").order_by('-created_at')
     return render(request, "profile.html", {"user": request.user, "orders": orders})
 
 
 @login_required
+@conditional_page(order_state)
 def order_detail(request, pk):
-    order = Order.objects.get(pk=pk)
-    if request.user.pk != order.user.pk:
+    order = Order.objects.prefetch_related("items__product").get(pk=pk)
+    if request.user.pk != order.user_id:
         return redirect("index")
     return render(request, "order_detail.html", {"user": request.user, "order": order})
 
 
-@login_required
 def cart(request):
-    cart, _ = Cart.objects.prefetch_related("items__product").get_or_create(user=request.user)
+    cart = get_cart(request)
     if request.method == "POST":
+        if cart.is_session:
+            return redirect_to_login(request.get_full_path())
         form = OrderConfirm(request.POST)
         if form.is_valid():
-            order = Order.objects.create(
-                user = request.user,
-                first_name = form.cleaned_data['first_name'],
-                last_name = form.cleaned_data['last_name'],
-                email = form.cleaned_data['email'],
-                phone = form.cleaned_data['phone'],
-                address_street = form.cleaned_data['address_street'],
-                address_building = form.cleaned_data['address_building'],
-                address_apartment = form.cleaned_data['address_apartment'],
-                address_floor = form.cleaned_data['address_floor']
-            )
-            order.save()
-            print(request.POST)
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order = order,
-                    product = cart_item.product,
-                    quantity = cart_item.quantity
-                )
-            cart.items.all().delete()
-            
+            order_data = dict(form.cleaned_data)
+            token = order_data.pop("checkout_token")
+            try:
+                order = checkout(cart.cart, order_data, token)
+            except EmptyCart:
+                messages.error(request, "Корзина пуста")
+                return redirect("cart")
+
             return redirect('order_detail', pk=order.pk)
     else:
         form = OrderConfirm()
 
+    items = cart.lines()
     return render(
         request,
         "cart.html",
-        {"user": request.user, "cart": cart, "items": cart.items.all(), "form":form},
+        {"user": request.user, "items": items, "cart_total": cart.total(items), "form":form},
     )
 
 
-@login_required
+def _wants_fragment(request):
+    return request.headers.get("x-requested-with") == "XMLHttpRequest"
+
+
+def _cart_response(request, cart, slug, redirect_to):
+    if _wants_fragment(request):
+        item = cart.line(slug)
+        response = JsonResponse(
+            {
+                "slug": slug,
+                "quantity": item.quantity if item else 0,
+                "line_total": localize(item.price) if item else "0",
+                "cart_total": localize(cart.total()),
+                "html": render_to_string("cart_item.html", {"item": item}, request) if item else "",
+            }
+        )
+    else:
+        response = redirect_to
+    cart.save(response)
+    return response
+
+
+@require_POST
 def add_to_cart(request, slug):
-    cart, _ = Cart.objects.get_or_create(user=request.user)
+    cart = get_cart(request)
     product = get_object_or_404(Product, slug=slug)
-    if request.method == "POST":
-        item, created = CartItem.objects.get_or_create(product=product, cart=cart)
-        if created:
-            item.quantity = 1
-        else:
-            item.quantity += 1
-            item.save()
+    cart.add(product)
+    if not _wants_fragment(request):
         messages.success(request, mark_safe(f'Предмет успешно добавлен в <a href="{reverse("cart")}" class="alert-link">корзину!</a>'))
-        return redirect("product_detail", slug=slug)
-
-    return redirect("product_detail", slug=slug)
+    return _cart_response(request, cart, slug, redirect("product_detail", slug=slug))
 
 
-@login_required
+@require_POST
 def delete_from_cart(request, slug):
-    if request.method == "POST":
-        cart = Cart.objects.get(user=request.user)
-        CartItem.objects.filter(cart=cart, product__slug=slug).delete()
+    cart = get_cart(request)
+    cart.remove(slug)
+    if not _wants_fragment(request):
         messages.success(request, "Предмет успешно удалён из корзины!")
-        return redirect("cart")
+    return _cart_response(request, cart, slug, redirect("cart"))
 
-    return redirect("cart")
 
-@login_required
+@require_POST
 def cart_add_amount(request, slug):
-    # if request.method == "POST":
-        cart = Cart.objects.get(user=request.user)
-        item = CartItem.objects.get(cart=cart, product__slug=slug)
-        item.quantity += 1
-        item.save()
-        return redirect("cart")
+    cart = get_cart(request)
+    cart.increase(slug)
+    return _cart_response(request, cart, slug, redirect("cart"))
 
-    # return redirect("cart")
 
-@login_required
+@require_POST
 def cart_remove_amount(request, slug):
-    # if request.method == "POST":
-        cart = Cart.objects.get(user=request.user)
-        item = CartItem.objects.get(cart=cart, product__slug=slug)
-        if item.quantity <= 1:
-            item.delete()
-            messages.success(request, "Предмет успешно удалён из корзины!")
-        else:
-            item.quantity -= 1
-            item.save()
+    cart = get_cart(request)
+    if not cart.decrease(slug) and not _wants_fragment(request):
+        messages.success(request, "Предмет успешно удалён из корзины!")
+    return _cart_response(request, cart, slug, redirect("cart"))
 
-        return redirect("cart")
 
-    # return redirect("cart")
+def _set_order_status(request, pk, status, owner_only=True):
+    """Меняет статус заказа под блокировкой строки; None, если заказ чужой.
+
+    Статус и сводки продаж меняются в одной транзакции, а блокировка не даёт двум
+    одновременным запросам учесть один переход дважды.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=pk)
+        if owner_only and request.user.pk != order.user_id:
+            return None
+        order.status = status
+        order.save()
+    return order
+
 
 @login_required
 def pay(request, pk):
-    order = Order.objects.get(pk=pk)
-    if request.user.pk != order.user.pk:
-        return redirect("index")
-    if request.method == "POST":
-        order.status = "confirmed"
-        order.save()
+    if request.method == "POST" and _set_order_status(request, pk, "confirmed"):
         messages.success(request, "Ваш заказ успешно оформлен! Благодарим за оплату!")
         return redirect("profile", pk=request.user.pk)
     return redirect("index")
@@ -180,22 +370,15 @@ def pay(request, pk):
 
 @login_required
 def cancel(request, pk):
-    order = Order.objects.get(pk=pk)
-    if request.user.pk != order.user.pk:
-        return redirect("index")
-    if request.method == "POST":
-        order.status = "canceled"
-        order.save()
+    if request.method == "POST" and _set_order_status(request, pk, "canceled"):
         return redirect("profile", pk=request.user.pk)
     return redirect("index")
 
 
 @login_required
 def set_pending(request, pk):
-    order = Order.objects.get(pk=pk)
     if request.method == "POST":
-        order.status = "pending"
-        order.save()
+        _set_order_status(request, pk, "pending", owner_only=False)
         return redirect("order_detail", pk=pk)
     return redirect("index")
 
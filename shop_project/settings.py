@@ -50,11 +50,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время app включало остальные middleware
+    "shop.middleware.ServerTimingMiddleware",
+    "shop.middleware.NPlusOneMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "shop.middleware.CartCookieMiddleware",
+    "shop.middleware.ProfilerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -147,6 +152,74 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 LOGOUT_REDIRECT_URL = "index"
 LOGIN_REDIRECT_URL = "index"
 
+# Уменьшенные копии загруженных изображений для srcset; "avif" требует Pillow с libavif
+IMAGE_VARIANT_WIDTHS = [200, 400, 800]
+IMAGE_VARIANT_FORMATS = ["webp"]
+
+# Фоновые задачи (manage.py runworker). JOBS_RUN_EAGERLY=1 выполняет их сразу после коммита,
+# без отдельного воркера
+JOBS_RUN_EAGERLY = os.getenv("JOBS_RUN_EAGERLY") == "1"
+JOBS_VISIBILITY_TIMEOUT = 300
+
+# Кэш страниц каталога. CACHE_BACKEND: locmem (по умолчанию, свой у каждого процесса),
+# file, memcached или redis; CACHE_LOCATION — путь или адрес сервера.
+# При нескольких процессах нужен общий бэкенд, иначе сброс кэша виден только одному из них
+CACHE_BACKENDS = {
+    "locmem": ("django.core.cache.backends.locmem.LocMemCache", "shop"),
+    "file": ("django.core.cache.backends.filebased.FileBasedCache", os.path.join(BASE_DIR, "cache")),
+    "memcached": ("django.core.cache.backends.memcached.PyMemcacheCache", "127.0.0.1:11211"),
+    "redis": ("django.core.cache.backends.redis.RedisCache", "redis://127.0.0.1:6379/1"),
+}
+_cache_backend, _cache_location = CACHE_BACKENDS[os.getenv("CACHE_BACKEND", "locmem")]
+CACHES = {
+    "default": {
+        "BACKEND": _cache_backend,
+        "LOCATION": os.getenv("CACHE_LOCATION", _cache_location),
+    }
+}
+CATALOG_CACHE_TIMEOUT = 300
+
+# Адрес сайта для абсолютных ссылок в выгрузках (manage.py export_feed)
+SITE_URL = os.getenv("SITE_URL", "http://localhost:8000/")
+
+# Server-Timing и строка JSON в логе shop.timing на каждый запрос; запросы дольше
+# SLOW_REQUEST_MS пишутся с предупреждением и самыми дорогими SQL. Место вызова в коде
+# ищется только у SQL дольше SLOW_QUERY_MS и у SQL запроса, уже ставшего медленным.
+# SERVER_TIMING_TEMPLATES оборачивает Template.render для замера времени шаблонов
+SERVER_TIMING_HEADER = True
+SERVER_TIMING_TEMPLATES = True
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", 100))
+SLOW_REQUEST_TOP_SQL = 5
+
+# Поиск N+1: одинаковый по форме SQL не меньше NPLUSONE_THRESHOLD раз за запрос.
+# NPLUSONE_MODE: off, log (лог shop.nplusone) или raise (ошибка 500 — для разработки)
+# DEBUG из окружения — строка, и "False" была бы истиной: флаг разбирается явно
+NPLUSONE_MODE = os.getenv(
+    "NPLUSONE_MODE",
+    "log" if os.getenv("DEBUG", "").lower() in ("1", "true", "yes", "on") else "off",
+)
+NPLUSONE_SAMPLE_RATE = float(os.getenv("NPLUSONE_SAMPLE_RATE", 1.0))
+NPLUSONE_THRESHOLD = 5
+
+# Пароль пользователей loadtest* для manage.py loadtest --url; без него вход под ними невозможен
+LOADTEST_PASSWORD = os.getenv("LOADTEST_PASSWORD")
+
+# Профиль запроса по ?_profile=sample|cprofile или заголовку X-Profile (только сотрудники).
+# Хранятся последние PROFILE_KEEP файлов
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+PROFILE_KEEP = 100
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "shop.timing": {"handlers": ["console"], "level": os.getenv("TIMING_LOG_LEVEL", "INFO")},
+        "shop.nplusone": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
+
 DATA_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 10
 FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 10
 